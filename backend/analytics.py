@@ -0,0 +1,218 @@
+from collections import Counter, defaultdict
+from datetime import datetime, date, timedelta
+import click
+from flask import request
+from flask.cli import with_appcontext
+from flask_restx import Namespace, Resource
+from flask_jwt_extended import jwt_required
+from sqlalchemy import func, delete, insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from exts import db
+from models import DailySales, DailyItemSales, Item, Order, OrderItem, ArchivedOrder, ArchivedOrderItem
+
+# Sales analytics served from daily rollup tables.
+# Checkout and order status changes update the rollups incrementally inside
+# their own transaction (an order whose payment fails is taken back out),
+# `flask rebuild-analytics` recomputes them from the orders, and the
+# /analytics endpoints only read the rollups, never the order tables.
+
+analytics_ns = Namespace('analytics', description='Sales analytics operations')
+
+DEFAULT_RANGE_DAYS = 30
+
+
+def today():
+    return datetime.utcnow().date()
+
+
+def _add_daily(day, **increments):
+    # Add the increments to the day's DailySales row, creating it if needed
+    values = {'orders': 0, 'revenue': 0.0, 'units': 0, 'cancellations': 0, 'cancelled_revenue': 0.0}
+    values.update(increments)
+    stmt = sqlite_insert(DailySales).values(day=day, **values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['day'],
+        set_={column: getattr(DailySales, column) + stmt.excluded[column] for column in increments}
+    )
+    db.session.execute(stmt)
+
+
+def record_order_placed(total_price, lines, day=None):
+    # lines maps item_id to (units, revenue) for the order
+    _add_order(day or today(), 1, total_price, lines)
+
+
+def record_payment_failed(order):
+    # Take an order whose payment failed back out of the rollups of the day it was placed
+    lines = {
+        item_id: (-units, -revenue) for item_id, units, revenue in db.session.query(
+            OrderItem.item_id, func.sum(OrderItem.quantity), func.sum(OrderItem.total_price)
+        ).filter(OrderItem.order_id == order.id).group_by(OrderItem.item_id)
+    }
+    _add_order(order.created_at.date(), -1, -order.total_price, lines)
+
+
+def _add_order(day, orders, total_price, lines):
+    _add_daily(day, orders=orders, revenue=total_price, units=sum(units for units, _ in lines.values()))
+    if lines:
+        stmt = sqlite_insert(DailyItemSales)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['day', 'item_id'],
+            set_={
+                'units': DailyItemSales.units + stmt.excluded.units,
+                'revenue': DailyItemSales.revenue + stmt.excluded.revenue
+            }
+        )
+        db.session.execute(stmt, [
+            {'day': day, 'item_id': item_id, 'units': units, 'revenue': revenue}
+            for item_id, (units, revenue) in lines.items()
+        ])
+
+
+def record_orders_cancelled(count, total_price, day=None):
+    if count:
+        _add_daily(day or today(), cancellations=count, cancelled_revenue=total_price)
+
+
+def _aggregate(order_model, line_model, daily, items):
+    # Add the per day totals of one order source into the daily and items
+    # counters, orders whose payment failed don't count
+    day = func.date(order_model.created_at)
+    placed = order_model.status != 'Payment Failed'
+    for order_day, orders, revenue in db.session.query(
+            day, func.count(order_model.id), func.sum(order_model.total_price)).filter(placed).group_by(day):
+        daily[order_day]['orders'] += orders
+        daily[order_day]['revenue'] += revenue
+
+    # cancellations are counted on the day of the order's last status change
+    cancel_day = func.date(order_model.updated_at)
+    for order_day, cancellations, cancelled_revenue in db.session.query(
+            cancel_day, func.count(order_model.id), func.sum(order_model.total_price)
+    ).filter(order_model.status == 'Cancelled').group_by(cancel_day):
+        daily[order_day]['cancellations'] += cancellations
+        daily[order_day]['cancelled_revenue'] += cancelled_revenue
+
+    for order_day, item_id, units, revenue in db.session.query(
+            day, line_model.item_id, func.sum(line_model.quantity), func.sum(line_model.total_price)
+    ).join(order_model, order_model.id == line_model.order_id).filter(placed).group_by(day, line_model.item_id):
+        daily[order_day]['units'] += units
+        items[(order_day, item_id)]['units'] += units
+        items[(order_day, item_id)]['revenue'] += revenue
+
+
+def rebuild_analytics():
+    # Recompute every rollup from the order tables and the archive
+    daily = defaultdict(Counter)
+    items = defaultdict(Counter)
+    _aggregate(Order, OrderItem, daily, items)
+    _aggregate(ArchivedOrder, ArchivedOrderItem, daily, items)
+
+    db.session.execute(delete(DailyItemSales))
+    db.session.execute(delete(DailySales))
+    if daily:
+        db.session.execute(insert(DailySales), [{
+            'day': date.fromisoformat(day),
+            'orders': totals['orders'],
+            'revenue': totals['revenue'],
+            'units': totals['units'],
+            'cancellations': totals['cancellations'],
+            'cancelled_revenue': totals['cancelled_revenue']
+        } for day, totals in daily.items()])
+    if items:
+        db.session.execute(insert(DailyItemSales), [{
+            'day': date.fromisoformat(day),
+            'item_id': item_id,
+            'units': totals['units'],
+            'revenue': totals['revenue']
+        } for (day, item_id), totals in items.items()])
+    db.session.commit()
+
+
+@click.command('rebuild-analytics')
+@with_appcontext
+def rebuild_analytics_command():
+    """Recompute the daily sales rollups from all orders."""
+    rebuild_analytics()
+    click.echo('Sales rollups rebuilt.')
+
+
+def _date_range():
+    # Parse the start and end query arguments (YYYY-MM-DD), defaulting to the last 30 days
+    end = request.args.get('end')
+    start = request.args.get('start')
+    try:
+        end = date.fromisoformat(end) if end else today()
+        start = date.fromisoformat(start) if start else end - timedelta(days=DEFAULT_RANGE_DAYS - 1)
+    except ValueError:
+        analytics_ns.abort(400, 'start and end must be dates formatted as YYYY-MM-DD')
+    return start, end
+
+
+date_params = {'start': 'First day (YYYY-MM-DD), defaults to 30 days ago', 'end': 'Last day (YYYY-MM-DD), defaults to today'}
+
+
+# daily rollups in a date range
+@analytics_ns.route('/daily')
+class DailyAnalytics(Resource):
+    @jwt_required()
+    @analytics_ns.doc(params=date_params)
+    def get(self):
+        start, end = _date_range()
+        days = DailySales.query.filter(DailySales.day.between(start, end)).order_by(DailySales.day).all()
+        return [day.serialize() for day in days], 200
+
+
+# totals over a date range
+@analytics_ns.route('/summary')
+class SummaryAnalytics(Resource):
+    @jwt_required()
+    @analytics_ns.doc(params=date_params)
+    def get(self):
+        start, end = _date_range()
+        orders, revenue, units, cancellations, cancelled_revenue = db.session.query(
+            func.coalesce(func.sum(DailySales.orders), 0),
+            func.coalesce(func.sum(DailySales.revenue), 0.0),
+            func.coalesce(func.sum(DailySales.units), 0),
+            func.coalesce(func.sum(DailySales.cancellations), 0),
+            func.coalesce(func.sum(DailySales.cancelled_revenue), 0.0)
+        ).filter(DailySales.day.between(start, end)).one()
+
+        return {
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'orders': orders,
+            'revenue': revenue,
+            'net_revenue': revenue - cancelled_revenue,
+            'units': units,
+            'cancellations': cancellations,
+            'cancelled_revenue': cancelled_revenue,
+            'average_basket_size': units / orders if orders else 0,
+            'average_order_value': revenue / orders if orders else 0
+        }, 200
+
+
+# units and revenue per item over a date range, best sellers first
+@analytics_ns.route('/items')
+class ItemAnalytics(Resource):
+    @jwt_required()
+    @analytics_ns.doc(params=dict(date_params, limit='Number of items, 20 by default'))
+    def get(self):
+        start, end = _date_range()
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 200)
+
+        units = func.sum(DailyItemSales.units).label('units')
+        rows = (
+            db.session.query(DailyItemSales.item_id, Item.name, units, func.sum(DailyItemSales.revenue))
+            .outerjoin(Item, Item.id == DailyItemSales.item_id)
+            .filter(DailyItemSales.day.between(start, end))
+            .group_by(DailyItemSales.item_id, Item.name)
+            .order_by(units.desc())
+            .limit(limit)
+            .all()
+        )
+        return [{
+            'item_id': item_id,
+            'name': name,
+            'units': item_units,
+            'revenue': revenue
+        } for item_id, name, item_units, revenue in rows], 200
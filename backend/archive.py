@@ -0,0 +1,139 @@
+from datetime import datetime, timedelta
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import delete, insert, select, func, text
+from sqlalchemy.exc import IntegrityError, OperationalError
+from exts import db
+from models import Order, OrderItem, PaymentJob, CheckoutItem, ArchivedOrder, ArchivedOrderItem
+
+# Archive of old orders.
+# Processed and cancelled orders older than a threshold are moved from the
+# order tables into a separate SQLite database (the 'archive' bind), so the
+# hot order table stays small. Order history reads both, see order_assembly.
+
+ARCHIVE_STATUSES = ('Processed', 'Cancelled', 'Payment Failed')
+DEFAULT_ARCHIVE_DAYS = 90
+ARCHIVE_BATCH_SIZE = 500
+
+ORDER_COLUMNS = ['id', 'user_id', 'status', 'total_price', 'version', 'created_at', 'updated_at']
+ORDER_ITEM_COLUMNS = ['id', 'order_id', 'item_id', 'quantity', 'total_price',
+                      'item_name', 'unit_price', 'discount', 'picture']
+
+
+class ArchiveConflict(Exception):
+    # The archive already holds a different order or order item with the same id
+    pass
+
+
+def init_app(app):
+    # Create the archive tables if needed, the archive database is not
+    # managed by the migrations
+    with app.app_context():
+        db.create_all(bind_key='archive')
+        try:
+            skip_archived_ids()
+        except OperationalError:
+            # Order tables not created yet, e.g. before `flask db upgrade`
+            db.session.rollback()
+
+
+def skip_archived_ids():
+    # Move the order tables' AUTOINCREMENT sequences past the archived ids, so
+    # new orders never take the id of an archived one. Only needed for orders
+    # archived while the ids were still reused, afterwards it changes nothing.
+    for table, model in (('order', ArchivedOrder), ('order_item', ArchivedOrderItem)):
+        archived = db.session.query(func.max(model.id)).scalar()
+        if archived is None:
+            continue
+        seq = db.session.execute(
+            text('SELECT seq FROM sqlite_sequence WHERE name = :name'), {'name': table}).scalar()
+        if seq is None:
+            db.session.execute(
+                text('INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)'), {'name': table, 'seq': archived})
+        elif seq < archived:
+            db.session.execute(
+                text('UPDATE sqlite_sequence SET seq = :seq WHERE name = :name'), {'name': table, 'seq': archived})
+    db.session.commit()
+
+
+def archive_orders(days=DEFAULT_ARCHIVE_DAYS, batch_size=ARCHIVE_BATCH_SIZE):
+    # Move finished orders created more than `days` days ago, batch by batch.
+    # Each batch is copied to the archive and committed there before it is
+    # deleted from the order tables. Orders already archived by an interrupted
+    # run are not copied again, so the run can simply be repeated; any other
+    # id already in the archive raises ArchiveConflict and the batch stays in
+    # the order tables. Returns the number of orders archived.
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    archive_engine = db.engines['archive']
+    archived = 0
+
+    while True:
+        orders = (
+            db.session.query(*[getattr(Order, column) for column in ORDER_COLUMNS])
+            .filter(Order.status.in_(ARCHIVE_STATUSES), Order.created_at < cutoff)
+            .order_by(Order.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not orders:
+            return archived
+
+        order_ids = [order.id for order in orders]
+        order_items = (
+            db.session.query(*[getattr(OrderItem, column) for column in ORDER_ITEM_COLUMNS])
+            .filter(OrderItem.order_id.in_(order_ids))
+            .all()
+        )
+
+        now = datetime.utcnow()
+        with archive_engine.begin() as connection:
+            copies = {
+                copy.id: copy for copy in connection.execute(
+                    select(ArchivedOrder.id, ArchivedOrder.user_id, ArchivedOrder.created_at)
+                    .where(ArchivedOrder.id.in_(order_ids)))
+            }
+            for order in orders:
+                copy = copies.get(order.id)
+                if copy is not None and (copy.user_id, copy.created_at) != (order.user_id, order.created_at):
+                    raise ArchiveConflict(f"Order {order.id} is already archived as a different order")
+
+            # the items of an archived order were copied in the same transaction
+            new_orders = [order for order in orders if order.id not in copies]
+            new_items = [order_item for order_item in order_items if order_item.order_id not in copies]
+            try:
+                if new_orders:
+                    connection.execute(
+                        insert(ArchivedOrder),
+                        [dict(order._mapping, archived_at=now) for order in new_orders]
+                    )
+                if new_items:
+                    connection.execute(
+                        insert(ArchivedOrderItem),
+                        [dict(order_item._mapping) for order_item in new_items]
+                    )
+            except IntegrityError as e:
+                raise ArchiveConflict(f"Order items of orders {order_ids[0]} to {order_ids[-1]} are already archived") from e
+
+        db.session.execute(delete(OrderItem).where(OrderItem.order_id.in_(order_ids)))
+        # the card details of the payments go too, nothing else refers to them
+        checkout_item_ids = db.session.execute(
+            delete(PaymentJob).where(PaymentJob.order_id.in_(order_ids)).returning(PaymentJob.checkout_item_id)
+        ).scalars().all()
+        if checkout_item_ids:
+            db.session.execute(delete(CheckoutItem).where(CheckoutItem.id.in_(checkout_item_ids)))
+        db.session.execute(delete(Order).where(Order.id.in_(order_ids)))
+        db.session.commit()
+        archived += len(order_ids)
+
+
+@click.command('archive-orders')
+@click.option('--days', default=DEFAULT_ARCHIVE_DAYS, show_default=True,
+              help='Archive finished orders created more than this many days ago.')
+@with_appcontext
+def archive_orders_command(days):
+    """Move old processed and cancelled orders to the archive database."""
+    try:
+        archived = archive_orders(days)
+    except ArchiveConflict as e:
+        raise click.ClickException(str(e))
+    click.echo(f'{archived} orders archived.')
@@ -2,9 +2,10 @@ from flask_restx import Namespace, Resource, fields
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_jwt_extended import create_access_token, create_refresh_token
 from flask import request, jsonify, current_app
-import os
 from exts import db
 from models import User
+from ratelimit import rate_limited
+from uploads import store_profile_picture
 
 # Establish a namespace for authentication of the user 
 
@@ -35,6 +36,7 @@ login_model = auth_ns.model(
 class Signup(Resource):
 
     @auth_ns.expect(signup_model)
+    @rate_limited('signup', lambda: request.form.get('username'))
     def post(self):
         data = request.form
 
@@ -45,17 +47,13 @@ class Signup(Resource):
         if db_user is not None:
             return jsonify({"message": f"User with username {username} already exists"})
 
-        # Handle profile picture upload
+        # Handle profile picture upload, stored under its content hash while
+        # the avatar sizes are generated in the background
         profile_picture = request.files.get('profilePicture')
         if profile_picture:
-            profile_picture_dir = current_app.config['UPLOAD_FOLDER']
-            if not os.path.exists(profile_picture_dir):
-                os.makedirs(profile_picture_dir)
-
-            # Save only the filename
-            profile_picture_filename = profile_picture.filename
-            profile_picture_path = os.path.join(profile_picture_dir, profile_picture_filename)
-            profile_picture.save(profile_picture_path)
+            profile_picture_filename = store_profile_picture(profile_picture, current_app.config['UPLOAD_FOLDER'])
+            if profile_picture_filename is None:
+                return jsonify({"message": "Profile picture must be a png, jpg, gif or webp image"})
         else:
             return jsonify({"message": "Profile picture is required!"})
 
@@ -76,6 +74,7 @@ class Signup(Resource):
 class Login(Resource):
 
     @auth_ns.expect(login_model)
+    @rate_limited('login', lambda: (request.get_json(silent=True) or {}).get('username'))
     def post(self):
         data = request.get_json()
         username = data.get('username')
@@ -93,4 +92,4 @@ class Login(Resource):
                 {"access_token": access_token, "refresh_token": refresh_token}
             )
 
-        return jsonify({"message": "Invalid credentials"})
\ No newline at end of file
+        return jsonify({"message": "Invalid credentials"})
@@ -1,13 +1,55 @@
 from flask_restx import Namespace, Resource, fields
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import User, CartItem
+from models import User, CartItem, recipe_item
 from flask import jsonify, request
+from sqlalchemy import select, literal, func, case
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from exts import db
 
 # Establish a namespace for cart related operations
 cart_ns = Namespace('cart', description='Cart related operations')
 
 
+# Lines already in the cart get the inserted quantity added
+def _add_quantities(stmt):
+    return stmt.on_conflict_do_update(
+        index_elements=['user_id', 'item_id'],
+        set_={'quantity': CartItem.quantity + stmt.excluded.quantity}
+    )
+
+
+# Add quantities to the user's cart in one statement: rows is a SELECT of
+# (user_id, item_id, quantity)
+def upsert_cart_items(rows):
+    stmt = sqlite_insert(CartItem).from_select(['user_id', 'item_id', 'quantity'], rows)
+    return db.session.execute(_add_quantities(stmt))
+
+
+# Add quantities to the user's cart in one statement: quantities maps item
+# ids to the quantity to add
+def add_cart_items(user_id, quantities):
+    if not quantities:
+        return None
+    stmt = sqlite_insert(CartItem).values([
+        {'user_id': user_id, 'item_id': item_id, 'quantity': quantity}
+        for item_id, quantity in quantities.items()
+    ])
+    return db.session.execute(_add_quantities(stmt))
+
+
+# Add the ingredients of recipes to the user's cart in one statement:
+# quantities maps recipe ids to the number of times to add them, an item used
+# by several of the recipes gets a single line with the summed quantity
+def add_recipe_ingredients(user_id, quantities):
+    rows = (
+        select(literal(user_id), recipe_item.c.item_id,
+               func.sum(case(quantities, value=recipe_item.c.recipe_id, else_=0)))
+        .where(recipe_item.c.recipe_id.in_(quantities))
+        .group_by(recipe_item.c.item_id)
+    )
+    return upsert_cart_items(rows)
+
+
 # Model defined for cart items
 cart_item_model = cart_ns.model(
     'CartItem', {
@@ -67,9 +109,8 @@ class AddToCart(Resource):
                 cart_ns.logger.debug("Item ID and quantity are required")
                 return {'message': 'Item ID and quantity are required'}, 400
 
-            # To add new item in the cart
-            new_item = CartItem(user_id=user.id, item_id=item_id, quantity=quantity)
-            db.session.add(new_item)
+            # To add the item in the cart, or add to its quantity if it is already there
+            add_cart_items(user.id, {item_id: quantity})
             db.session.commit()
 
             cart_ns.logger.debug("Item added to cart")
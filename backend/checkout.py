@@ -1,8 +1,16 @@
 from flask_restx import Namespace, Resource, fields
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import User, CartItem, Order, OrderItem, CheckoutItem, Item
+from models import User, CartItem, Order, OrderItem, CheckoutItem, Item, PaymentJob, ArchivedOrder, ArchivedOrderItem
 from flask import jsonify, request
+from sqlalchemy import insert, delete
 from exts import db
+from idempotency import idempotent
+from sales import record_checkout_sales, record_purchases
+from payments import payment_queue
+from order_assembly import serialize_checkout_orders
+from events import publish_order_created
+from analytics import record_order_placed
+from collections import Counter
 
 # Establish a namespacee for checkout related operationss
 
@@ -22,6 +30,7 @@ payment_model = checkout_ns.model(
 @checkout_ns.route('/payment')
 class ProcessPayment(Resource):
     @jwt_required()
+    @idempotent('checkout')
     @checkout_ns.expect(payment_model)
     def post(self):
 
@@ -50,47 +59,101 @@ class ProcessPayment(Resource):
         if not user:
             return {'message': 'User not found'}, 404
 
+        # Load the cart lines together with their items in one query
+        cart_rows = (
+            db.session.query(CartItem, Item)
+            .outerjoin(Item, CartItem.item_id == Item.id)
+            .filter(CartItem.user_id == user.id)
+            .all()
+        )
+
         # Calculate the total price for the order
-        cart_items = CartItem.query.filter_by(user_id=user.id).all()
         total_price = 0
-        for cart_item in cart_items:
-            item = Item.query.filter_by(id=cart_item.item_id).first()
+        for cart_item, item in cart_rows:
             if item is None:
                 return {'message': f'Item with id {cart_item.item_id} not found'}, 404
             total_price += item.price * cart_item.quantity
 
-        # Create a new order
-        new_order = Order(
-            user_id=user.id,
-            total_price=total_price,
-            status='Pending'
-        )
-        db.session.add(new_order)
-        db.session.commit()
-
-        # Add items from the cart to the order
-        for cart_item in cart_items:
-            item = Item.query.filter_by(id=cart_item.item_id).first()
-            if item:
-                order_item = OrderItem(
-                    order_id=new_order.id,
-                    item_id=item.id,
-                    quantity=cart_item.quantity,
-                    total_price=item.price * cart_item.quantity
-                )
-                db.session.add(order_item)
-
-        db.session.commit()
-
-        # Clear the cart of the user
-        CartItem.query.filter_by(user_id=user.id).delete()
-        db.session.commit()
+        try:
+            # Create a new order, flushed so its id is available for the order items
+            new_order = Order(
+                user_id=user.id,
+                total_price=total_price,
+                status='Pending'
+            )
+            db.session.add(new_order)
+            db.session.flush()
+
+            # Add items from the cart to the order in a single bulk insert
+            if cart_rows:
+                db.session.execute(insert(OrderItem), [
+                    {
+                        'order_id': new_order.id,
+                        'item_id': item.id,
+                        'quantity': cart_item.quantity,
+                        'total_price': item.price * cart_item.quantity,
+                        'item_name': item.name,
+                        'unit_price': item.price,
+                        'discount': item.discount,
+                        'picture': item.picture
+                    }
+                    for cart_item, item in cart_rows
+                ])
+
+            # Update the sales counters, the user's purchase history and the daily rollups,
+            # all of which are taken back if the payment fails (see payments)
+            sold = Counter()
+            revenue = Counter()
+            for cart_item, item in cart_rows:
+                sold[item.id] += cart_item.quantity
+                revenue[item.id] += item.price * cart_item.quantity
+            record_checkout_sales(dict(sold))
+            record_purchases(user.id, sold.keys())
+            record_order_placed(total_price, {item_id: (sold[item_id], revenue[item_id]) for item_id in sold})
+
+            # Clear the cart of the user, a failed payment puts the items back
+            db.session.execute(delete(CartItem).where(CartItem.user_id == user.id))
+
+            # Save the checkout details and queue the payment
+            checkout_item = CheckoutItem(ccNumber=ccNumber, expiry=expiry, ccv=ccv)
+            payment_job = PaymentJob(order=new_order, checkout_item=checkout_item, status='Queued')
+            db.session.add_all([checkout_item, payment_job])
+
+            # Everything above is committed together, a failure leaves no partial order
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            checkout_ns.logger.error(f"Checkout failed: {str(e)}")
+            return {'message': 'Checkout failed, please try again'}, 500
+
+        # Notify the employee dashboard, then let the background workers charge
+        # the payment while the client polls the status URL
+        publish_order_created(new_order)
+        payment_queue.enqueue(payment_job.id)
+
+        return {
+            "message": "Order placed, payment is being processed.",
+            "order_id": new_order.id,
+            "payment_id": payment_job.id,
+            "status_url": f"/checkout/payment/{payment_job.id}"
+        }, 202
+
+
+# Poll the status of a payment and its order
+@checkout_ns.route('/payment/<int:payment_id>')
+class PaymentStatus(Resource):
+    @jwt_required()
+    def get(self, payment_id):
+        current_user = get_jwt_identity()
+        user = User.query.filter_by(username=current_user).first()
+        if not user:
+            return {'message': 'User not found'}, 404
 
-        # Save the checkout details
-        new_checkout_item = CheckoutItem(ccNumber=ccNumber, expiry=expiry, ccv=ccv)
-        new_checkout_item.save()
+        payment_job = PaymentJob.query.get(payment_id)
+        if not payment_job or payment_job.order.user_id != user.id:
+            return {'message': 'Payment not found'}, 404
 
-        return {"message": "Success! Payment has been received."}, 200
+        return payment_job.serialize(), 200
 
 # Retrieve checkout items
 @checkout_ns.route('/items')
@@ -103,30 +166,11 @@ class CheckoutItems(Resource):
             return {'message': 'User not found'}, 404
 
     
-        # query all the orders for the current user
+        # query all the orders for the current user, archived ones included
         orders = Order.query.filter_by(user_id=user.id).all()
-        result = []
-        for order in orders:
-            order_data = {
-                'id': order.id,
-                'total_price': order.total_price,
-                'status': order.status,
-                'items': []
-            }
-
-
-            # query all the items for the current order
-            order_items = OrderItem.query.filter_by(order_id=order.id).all()
-            for order_item in order_items:
-                item = Item.query.filter_by(id=order_item.item_id).first()
-                if item:
-                    order_data['items'].append({
-                        'id': item.id,
-                        'name': item.name,
-                        'price': item.price,
-                        'quantity': order_item.quantity,
-                        'total_price': order_item.total_price
-                    })
-            result.append(order_data)
-
-        return result, 200
\ No newline at end of file
+        archived = ArchivedOrder.query.filter_by(user_id=user.id).all()
+
+        # build each order with its items, batched across all the orders
+        orders_data = serialize_checkout_orders(orders) + serialize_checkout_orders(archived, ArchivedOrderItem)
+        orders_data.sort(key=lambda order: order['id'])
+        return orders_data, 200
\ No newline at end of file
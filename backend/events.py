@@ -0,0 +1,116 @@
+import json
+import queue
+import threading
+from collections import deque
+
+# In-process publish/subscribe for order events, streamed to the employee
+# dashboard as Server-Sent Events. Recent events are kept in a ring buffer so
+# a reconnecting client can resume from its Last-Event-ID. Events are only
+# seen by subscribers of the same process.
+
+ORDER_CREATED = 'order-created'
+ORDER_STATUS_CHANGED = 'order-status-changed'
+
+HEARTBEAT_INTERVAL = 15
+
+
+class EventBroker:
+    def __init__(self, history=1000, max_queue=1000):
+        self._history = deque(maxlen=history)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self.max_queue = max_queue
+
+    def publish(self, event_type, data):
+        self.publish_many(event_type, [data])
+
+    def publish_many(self, event_type, items):
+        # Publish one event per item, numbered and delivered as a batch
+        with self._lock:
+            events = []
+            for data in items:
+                events.append((self._next_id, event_type, data))
+                self._next_id += 1
+            self._history.extend(events)
+            subscribers = list(self._subscribers)
+
+        for subscriber in subscribers:
+            try:
+                for event in events:
+                    subscriber.put_nowait(event)
+            except queue.Full:
+                # Slow client, it will resume from the history when it reconnects
+                self.unsubscribe(subscriber)
+
+    def subscribe(self, last_event_id=None):
+        # Returns the subscriber queue and the buffered events after last_event_id
+        subscriber = queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            missed = [event for event in self._history
+                      if last_event_id is not None and event[0] > last_event_id]
+        return subscriber, missed
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def is_subscribed(self, subscriber):
+        with self._lock:
+            return subscriber in self._subscribers
+
+
+order_events = EventBroker()
+
+
+def publish_order_created(order):
+    order_events.publish(ORDER_CREATED, {
+        'order_id': order.id,
+        'user_id': order.user_id,
+        'status': order.status,
+        'total_price': order.total_price
+    })
+
+
+def publish_status_changed(order_id, status, previous_status):
+    order_events.publish(ORDER_STATUS_CHANGED, {
+        'order_id': order_id,
+        'status': status,
+        'previous_status': previous_status
+    })
+
+
+def publish_status_changed_many(order_ids, status, previous_status):
+    order_events.publish_many(ORDER_STATUS_CHANGED, [{
+        'order_id': order_id,
+        'status': status,
+        'previous_status': previous_status
+    } for order_id in order_ids])
+
+
+def format_event(event):
+    event_id, event_type, data = event
+    return f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+
+def event_stream(broker, last_event_id=None):
+    # Generator of SSE messages: missed events first, then live ones, with a
+    # comment line as heartbeat so proxies keep the connection open
+    subscriber, missed = broker.subscribe(last_event_id)
+    try:
+        yield "retry: 3000\n\n"
+        for event in missed:
+            yield format_event(event)
+        while True:
+            try:
+                event = subscriber.get(timeout=HEARTBEAT_INTERVAL)
+            except queue.Empty:
+                if not broker.is_subscribed(subscriber):
+                    # Dropped for falling behind, end the stream so the client reconnects
+                    return
+                yield ": keep-alive\n\n"
+                continue
+            yield format_event(event)
+    finally:
+        broker.unsubscribe(subscriber)
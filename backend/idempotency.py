@@ -0,0 +1,140 @@
+import json
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import request, current_app, Response
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+from exts import db
+from models import IdempotencyKey
+
+# Idempotency-Key support for mutating endpoints.
+# The first request with a key reserves it, runs the handler and stores the
+# response; retries with the same key get the stored response back without
+# running the handler again. A reservation is a lease: if no response was
+# stored within IDEMPOTENCY_LEASE (the process died mid-request), a retry
+# takes the key over instead of getting 409 until the key expires.
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+DEFAULT_TTL = timedelta(hours=24)
+DEFAULT_LEASE = timedelta(seconds=60)
+PURGE_EVERY = 100
+
+_requests_seen = 0
+
+
+def _normalize(result):
+    # Split a resource return value into (body, status code, headers)
+    if isinstance(result, Response):
+        return result.get_json(silent=True), result.status_code, {}
+    if isinstance(result, tuple):
+        body = result[0]
+        status = result[1] if len(result) > 1 else 200
+        headers = result[2] if len(result) > 2 else {}
+        if isinstance(body, Response):
+            body = body.get_json(silent=True)
+        return body, status, headers
+    return result, 200, {}
+
+
+def purge_expired_keys():
+    # Delete every expired key, uses the expires_at index
+    db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at < datetime.utcnow()))
+    db.session.commit()
+
+
+def _release(record_id, reserved_at):
+    db.session.rollback()
+    db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.id == record_id,
+                                                    IdempotencyKey.reserved_at == reserved_at))
+    db.session.commit()
+
+
+def _take_over(record, now):
+    # Renew a stale reservation if nobody else did since it was read,
+    # returns whether this request now holds the key
+    taken = db.session.execute(
+        update(IdempotencyKey)
+        .where(IdempotencyKey.id == record.id, IdempotencyKey.status_code.is_(None),
+               IdempotencyKey.reserved_at == record.reserved_at)
+        .values(reserved_at=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount == 1
+    db.session.commit()
+    return taken
+
+
+# Decorator for JWT protected resource methods, must be applied below @jwt_required()
+def idempotent(endpoint):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            global _requests_seen
+
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            if not key:
+                return func(*args, **kwargs)
+            if len(key) > 255:
+                return {'message': f'{IDEMPOTENCY_HEADER} must be at most 255 characters'}, 400
+
+            _requests_seen += 1
+            if _requests_seen % PURGE_EVERY == 0:
+                purge_expired_keys()
+
+            username = get_jwt_identity()
+            now = datetime.utcnow()
+
+            # Look up the key through the (username, key) unique index
+            record = IdempotencyKey.query.filter_by(username=username, key=key).first()
+            if record and record.expires_at < now:
+                db.session.delete(record)
+                db.session.commit()
+                record = None
+
+            ttl = current_app.config.get('IDEMPOTENCY_KEY_TTL', DEFAULT_TTL)
+            lease = current_app.config.get('IDEMPOTENCY_LEASE', DEFAULT_LEASE)
+            if record:
+                if record.endpoint != endpoint:
+                    return {'message': f'{IDEMPOTENCY_HEADER} was already used for another request'}, 422
+                if record.status_code is not None:
+                    return json.loads(record.response), record.status_code, {'Idempotent-Replayed': 'true'}
+                if record.reserved_at > now - lease or not _take_over(record, now):
+                    return {'message': 'A request with this key is still being processed'}, 409
+                record_id = record.id
+            else:
+                # Reserve the key before running the handler so concurrent retries
+                # see it, the unique constraint decides which request wins
+                record = IdempotencyKey(username=username, key=key, endpoint=endpoint,
+                                        created_at=now, reserved_at=now, expires_at=now + ttl)
+                db.session.add(record)
+                try:
+                    db.session.commit()
+                except IntegrityError:
+                    db.session.rollback()
+                    return {'message': 'A request with this key is still being processed'}, 409
+                record_id = record.id
+
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                # Failed requests (including aborts) may be retried with the same key
+                _release(record_id, now)
+                raise
+
+            body, status, _ = _normalize(result)
+            if status >= 500:
+                _release(record_id, now)
+                return result
+
+            # Store the response for replays, unless the lease was taken over
+            db.session.rollback()
+            db.session.execute(
+                update(IdempotencyKey)
+                .where(IdempotencyKey.id == record_id, IdempotencyKey.reserved_at == now)
+                .values(status_code=status, response=json.dumps(body))
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+            return result
+        return wrapper
+    return decorator
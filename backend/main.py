@@ -1,4 +1,5 @@
 import os
+import atexit
 from flask import Flask
 from flask_restx import Api
 from flask_migrate import Migrate
@@ -14,8 +15,16 @@ from cart import cart_ns
 from checkout import checkout_ns
 from orders import orders_ns
 from recipes import recipes_ns
+from analytics import analytics_ns, rebuild_analytics_command
+import archive
+from archive import archive_orders_command
+from sales import backfill_sales_command, sales_aggregator
+from payments import payment_queue
+from recipe_search import include_object
+from recipe_totals import refresh_recipe_totals_command
+from recipe_flags import refresh_recipe_flags_command
 
-def create_app():
+def create_app(config=None):
 
     # creating an insatnce for flask app
     app = Flask(__name__)
@@ -23,20 +32,31 @@ def create_app():
     # from config object load all the configurations
     app.config.from_object(Config)
     app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///dev.db"
+    # old orders moved out of the order table, see archive.py
+    app.config["SQLALCHEMY_BINDS"] = {"archive": "sqlite:///archive.db"}
     app.config["UPLOAD_FOLDER"] = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'static/uploads')
     app.config['JWT_SECRET_KEY'] = 'your_secret_key'
     app.config['IMAGES_FOLDER'] = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'images')
+    # overrides, e.g. the databases of the tests
+    app.config.update(config or {})
 
     db.init_app(app)
 
-    # Initialize Flask-Migrate to handle database migrations
-    migrate = Migrate(app, db)
+    # Initialize Flask-Migrate to handle database migrations, leaving the
+    # recipe search index (not a model) out of autogenerate
+    migrate = Migrate(app, db, include_object=include_object)
+
+    # Create the order archive tables
+    archive.init_app(app)
+
+    # Start the background payment workers
+    payment_queue.init_app(app)
 
     # Initialize Flask-JWT-Extended to handle JWT authentication
     jwt = JWTManager(app)
     
     # Enable CORS for the entire application
-    CORS(app, resources={r"/*": {"origins": "http://localhost:3000"}})
+    CORS(app, resources={r"/*": {"origins": "http://localhost:3000"}}, expose_headers=['X-Next-Cursor', 'X-Total-Count', 'X-Next-Page', 'ETag'])
 
 
     # Initialize Flask-RESTX to handle API namespaces and documentation 
@@ -51,6 +71,19 @@ def create_app():
     api.add_namespace(checkout_ns, path='/checkout')
     api.add_namespace(orders_ns, path='/orders')
     api.add_namespace(recipes_ns, path='/recipes')
+    api.add_namespace(analytics_ns, path='/analytics')
+
+    # Register CLI commands, run with e.g. `flask backfill-sales`
+    app.cli.add_command(backfill_sales_command)
+    app.cli.add_command(archive_orders_command)
+    app.cli.add_command(rebuild_analytics_command)
+    app.cli.add_command(refresh_recipe_totals_command)
+    app.cli.add_command(refresh_recipe_flags_command)
+
+    # Optionally coalesce item sales increments in memory and write them periodically
+    if app.config.get('SALES_WRITE_BEHIND'):
+        sales_aggregator.start(app)
+        atexit.register(sales_aggregator.stop, app)
 
     return app
 
@@ -0,0 +1,104 @@
+import heapq
+from collections import Counter
+from recipe_totals import item_cost
+
+# Greedy meal plan solver over the recipe catalog.
+# A plan picks one recipe per day. Ingredients shared by several recipes of
+# the plan are bought once, so reusing ingredients means buying fewer items.
+# Each round the solver takes the recipe adding the fewest new items to the
+# shopping list, then the cheapest to add, then the one whose ingredients
+# are most common among the candidates, while staying within the budget.
+# The candidates are kept in a heap; when a recipe is picked only the
+# candidates sharing its items, found through the catalog's posting lists,
+# are updated and pushed again.
+# The daily calories are a target, not a ceiling: only recipes within
+# CALORIE_TOLERANCE of it are candidates. A ceiling alone let the ranking,
+# which favours recipes with few ingredients, fill the plan with the smallest
+# dishes. Within the band the ranking above is unchanged.
+
+DEFAULT_DAYS = 7
+MAX_DAYS = 28
+
+# share of the daily calorie target a recipe may be off by
+CALORIE_TOLERANCE = 0.25
+
+
+def plan_meals(catalog, days=DEFAULT_DAYS, budget=None, daily_calories=None, vegan=False, gluten_free=False):
+    # Returns the planned recipes (fewer than days when the constraints
+    # can't be met) and the consolidated shopping list
+    candidates = [
+        recipe for recipe in catalog.recipes
+        if recipe['ingredients']
+        and (not vegan or recipe['is_vegan'])
+        and (not gluten_free or recipe['is_gluten_free'])
+        and (daily_calories is None
+             or abs(recipe['total_calories'] - daily_calories) <= daily_calories * CALORIE_TOLERANCE)
+    ]
+    position = {recipe['id']: index for index, recipe in enumerate(candidates)}
+    popularity = Counter(item['id'] for recipe in candidates for item in recipe['ingredients'])
+    shared = [-sum(popularity[item['id']] for item in recipe['ingredients']) for recipe in candidates]
+    new_items = [len(recipe['ingredients']) for recipe in candidates]
+    # the precomputed recipe totals, see recipe_totals
+    added_cost = [recipe['total_cost'] for recipe in candidates]
+
+    def entry(index):
+        return (new_items[index], round(added_cost[index], 2), shared[index], candidates[index]['id'], index)
+
+    # Candidates by rank; an entry is stale once its candidate changed, and
+    # the candidate is pushed again with its new rank
+    heap = [entry(index) for index in range(len(candidates))]
+    heapq.heapify(heap)
+    planned = []
+    picked = set()
+    have = set()
+    cost = 0.0
+    while len(planned) < days and heap:
+        ranked = heapq.heappop(heap)
+        index = ranked[-1]
+        if index in picked or ranked != entry(index):
+            continue
+        # skipped for good, its cost only drops if it is pushed again
+        if budget is not None and cost + added_cost[index] > budget + 0.005:
+            continue
+
+        picked.add(index)
+        recipe = candidates[index]
+        planned.append(recipe)
+        cost += added_cost[index]
+
+        # The recipe's new items are now free for the recipes also using them
+        changed = set()
+        for item in recipe['ingredients']:
+            if item['id'] in have:
+                continue
+            have.add(item['id'])
+            price = item_cost(item)
+            for recipe_id in catalog.postings[item['id']]:
+                other = position.get(recipe_id)
+                if other is not None and other not in picked:
+                    new_items[other] -= 1
+                    added_cost[other] -= price
+                    changed.add(other)
+        for other in changed:
+            heapq.heappush(heap, entry(other))
+
+    return planned, shopping_list(planned)
+
+
+def shopping_list(recipes):
+    # One line per ingredient of the recipes, bought once however many
+    # recipes use it
+    lines = {}
+    for recipe in recipes:
+        for item in recipe['ingredients']:
+            line = lines.get(item['id'])
+            if line is None:
+                lines[item['id']] = line = {
+                    'item_id': item['id'],
+                    'name': item['name'],
+                    'quantity': 1,
+                    'unit_price': item_cost(item),
+                    'recipes': 0
+                }
+            line['recipes'] += 1
+    return list(lines.values())
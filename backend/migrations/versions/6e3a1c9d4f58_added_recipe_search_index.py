@@ -0,0 +1,84 @@
+"""added recipe search index
+
+Revision ID: 6e3a1c9d4f58
+Revises: 9b6f0d2c8e45
+Create Date: 2026-10-19 17:42:10.581204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6e3a1c9d4f58'
+down_revision = '9b6f0d2c8e45'
+branch_labels = None
+depends_on = None
+
+
+# the recipe's row of the search index, rebuilt from the recipe tables
+INDEX_ROW = """
+    INSERT INTO recipe_fts (rowid, name, description, ingredients, is_vegan, is_gluten_free)
+    SELECT recipe.id, recipe.name, coalesce(recipe.description, ''),
+           coalesce((SELECT group_concat(item.name, ' ') FROM recipe_item
+                     JOIN item ON item.id = recipe_item.item_id
+                     WHERE recipe_item.recipe_id = recipe.id), ''),
+           coalesce(recipe.is_vegan, 0), coalesce(recipe.is_gluten_free, 0)
+    FROM recipe WHERE {where};
+"""
+
+
+def upgrade():
+    # FTS5 index over recipe names, descriptions and ingredient names, kept in
+    # sync with the recipe, recipe_item and item tables by triggers
+    op.execute("""
+        CREATE VIRTUAL TABLE recipe_fts USING fts5(
+            name, description, ingredients,
+            is_vegan UNINDEXED, is_gluten_free UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+    """)
+    op.execute(INDEX_ROW.format(where='1'))
+
+    op.execute(f"""
+        CREATE TRIGGER recipe_fts_recipe_insert AFTER INSERT ON recipe BEGIN
+            {INDEX_ROW.format(where='recipe.id = new.id')}
+        END
+    """)
+    op.execute(f"""
+        CREATE TRIGGER recipe_fts_recipe_update AFTER UPDATE ON recipe BEGIN
+            DELETE FROM recipe_fts WHERE rowid = old.id;
+            {INDEX_ROW.format(where='recipe.id = new.id')}
+        END
+    """)
+    op.execute("""
+        CREATE TRIGGER recipe_fts_recipe_delete AFTER DELETE ON recipe BEGIN
+            DELETE FROM recipe_fts WHERE rowid = old.id;
+        END
+    """)
+    op.execute(f"""
+        CREATE TRIGGER recipe_fts_recipe_item_insert AFTER INSERT ON recipe_item BEGIN
+            DELETE FROM recipe_fts WHERE rowid = new.recipe_id;
+            {INDEX_ROW.format(where='recipe.id = new.recipe_id')}
+        END
+    """)
+    op.execute(f"""
+        CREATE TRIGGER recipe_fts_recipe_item_delete AFTER DELETE ON recipe_item BEGIN
+            DELETE FROM recipe_fts WHERE rowid = old.recipe_id;
+            {INDEX_ROW.format(where='recipe.id = old.recipe_id')}
+        END
+    """)
+    op.execute(f"""
+        CREATE TRIGGER recipe_fts_item_update AFTER UPDATE OF name ON item BEGIN
+            DELETE FROM recipe_fts WHERE rowid IN (
+                SELECT recipe_id FROM recipe_item WHERE item_id = new.id);
+            {INDEX_ROW.format(where='recipe.id IN (SELECT recipe_id FROM recipe_item WHERE item_id = new.id)')}
+        END
+    """)
+
+
+def downgrade():
+    for trigger in ('recipe_fts_item_update', 'recipe_fts_recipe_item_delete', 'recipe_fts_recipe_item_insert',
+                    'recipe_fts_recipe_delete', 'recipe_fts_recipe_update', 'recipe_fts_recipe_insert'):
+        op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    op.execute('DROP TABLE IF EXISTS recipe_fts')
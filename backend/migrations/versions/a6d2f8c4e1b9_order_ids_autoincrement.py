@@ -0,0 +1,37 @@
+"""order ids autoincrement
+
+Revision ID: a6d2f8c4e1b9
+Revises: f3c9a1e5b7d4
+Create Date: 2026-10-20 10:03:27.914562
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6d2f8c4e1b9'
+down_revision = 'f3c9a1e5b7d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # SQLite only sets AUTOINCREMENT when a table is created, so both tables
+    # are rebuilt; the copied rows start their sequences. Ids of orders
+    # archived before this are skipped too, see archive.init_app
+    with op.batch_alter_table('order', schema=None, recreate='always',
+                              table_kwargs={'sqlite_autoincrement': True}) as batch_op:
+        pass
+
+    with op.batch_alter_table('order_item', schema=None, recreate='always',
+                              table_kwargs={'sqlite_autoincrement': True}) as batch_op:
+        pass
+
+
+def downgrade():
+    with op.batch_alter_table('order_item', schema=None, recreate='always') as batch_op:
+        pass
+
+    with op.batch_alter_table('order', schema=None, recreate='always') as batch_op:
+        pass
@@ -1,3 +1,4 @@
+from datetime import datetime
 from exts import db
 
 # Association table for many-to-many relationship between User and Items
@@ -80,6 +81,11 @@ class CartItem(db.Model):
     user = db.relationship('User', backref=db.backref('cart_items', lazy=True))
     item = db.relationship('Item', backref=db.backref('cart_items', lazy=True))
 
+    # one cart line per user and item, cart additions are upserts on it
+    __table_args__ = (
+        db.Index('uq_cart_item_user_id_item_id', 'user_id', 'item_id', unique=True),
+    )
+
     def __repr__(self):
         return f"<CartItem {self.item.name} x {self.quantity}>"
 
@@ -130,9 +136,21 @@ class Order(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     status = db.Column(db.String(20), nullable=False)
     total_price = db.Column(db.Float(), nullable=False)
+    # incremented on every status change, see order_states
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     user = db.relationship('User', backref=db.backref('orders', lazy=True))
 
+    # Indexes backing the keyset pagination of order lists by user and status.
+    # Ids are never reused (AUTOINCREMENT) since archived orders keep theirs
+    __table_args__ = (
+        db.Index('ix_order_user_id_id', 'user_id', 'id'),
+        db.Index('ix_order_status_id', 'status', 'id'),
+        {'sqlite_autoincrement': True},
+    )
+
     def __repr__(self):
         return f"<Order {self.id} by {self.user.username}>"
 
@@ -153,6 +171,46 @@ class Order(db.Model):
             }
         }
 
+# ArchivedOrder model holds old processed and cancelled orders moved out of
+# the order table by the archive command, stored in the separate archive database
+class ArchivedOrder(db.Model):
+    __bind_key__ = 'archive'
+    __tablename__ = 'order'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    total_price = db.Column(db.Float(), nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
+    updated_at = db.Column(db.DateTime, nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_archived_order_user_id_id', 'user_id', 'id'),
+    )
+
+    def __repr__(self):
+        return f"<ArchivedOrder {self.id}>"
+
+# ArchivedOrderItem model holds the items of an archived order
+class ArchivedOrderItem(db.Model):
+    __bind_key__ = 'archive'
+    __tablename__ = 'order_item'
+
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, nullable=False, index=True)
+    item_id = db.Column(db.Integer, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    total_price = db.Column(db.Float(), nullable=False)
+    item_name = db.Column(db.String(20), nullable=True)
+    unit_price = db.Column(db.Float(), nullable=True)
+    discount = db.Column(db.Float(), nullable=True)
+    picture = db.Column(db.String(120), nullable=True)
+
+    def __repr__(self):
+        return f"<ArchivedOrderItem {self.item_name} x {self.quantity}>"
+
 # OrderItem model represents an item in an order
 class OrderItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -161,9 +219,19 @@ class OrderItem(db.Model):
     quantity = db.Column(db.Integer, nullable=False)
     total_price = db.Column(db.Float(), nullable=False)
 
+    # snapshot of the item at checkout time, so order history neither needs the
+    # item table nor changes when the item is edited later
+    item_name = db.Column(db.String(20), nullable=True)
+    unit_price = db.Column(db.Float(), nullable=True)
+    discount = db.Column(db.Float(), nullable=True)
+    picture = db.Column(db.String(120), nullable=True)
+
     order = db.relationship('Order', backref=db.backref('order_items', lazy=True))
     item = db.relationship('Item', backref=db.backref('order_items', lazy=True))
 
+    # ids are never reused, archived order items keep theirs
+    __table_args__ = {'sqlite_autoincrement': True}
+
     def __repr__(self):
         return f"<OrderItem {self.item.name} x {self.quantity}>"
 
@@ -180,6 +248,10 @@ class OrderItem(db.Model):
             'item_id': self.item_id,
             'quantity': self.quantity,
             'total_price': self.total_price,
+            'item_name': self.item_name,
+            'unit_price': self.unit_price,
+            'discount': self.discount,
+            'picture': self.picture,
             'item': self.item.serialize() if self.item else None
         }
 
@@ -188,8 +260,12 @@ class Recipe(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text, nullable=True)
-    is_vegan = db.Column(db.Boolean, default=False)
-    is_gluten_free = db.Column(db.Boolean, default=False)
+    # derived from the ingredients, maintained by recipe_flags
+    is_vegan = db.Column(db.Boolean, default=False, index=True)
+    is_gluten_free = db.Column(db.Boolean, default=False, index=True)
+    # sums over the ingredients, maintained by recipe_totals
+    total_cost = db.Column(db.Float, nullable=False, default=0.0, index=True)
+    total_calories = db.Column(db.Integer, nullable=False, default=0, index=True)
     items = db.relationship('Item', secondary='recipe_item', lazy='subquery',
                             backref=db.backref('recipes', lazy=True))
 
@@ -201,11 +277,100 @@ class Recipe(db.Model):
             'description': self.description,
             'is_vegan': self.is_vegan,
             'is_gluten_free': self.is_gluten_free,
+            'total_cost': self.total_cost,
+            'total_calories': self.total_calories,
             'ingredients': [item.serialize() for item in self.items]
         }
 
 # Association table for many-to-many relationship between Recipe and Item
 recipe_item = db.Table('recipe_item',
     db.Column('recipe_id', db.Integer, db.ForeignKey('recipe.id'), primary_key=True),
-    db.Column('item_id', db.Integer, db.ForeignKey('item.id'), primary_key=True)
-)
\ No newline at end of file
+    db.Column('item_id', db.Integer, db.ForeignKey('item.id'), primary_key=True),
+    db.Index('ix_recipe_item_item_id', 'item_id')
+)
+
+# IdempotencyKey model stores the response of a mutating request so a retried
+# request with the same Idempotency-Key header replays it instead of running again
+class IdempotencyKey(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(25), nullable=False)
+    key = db.Column(db.String(255), nullable=False)
+    endpoint = db.Column(db.String(100), nullable=False)
+    status_code = db.Column(db.Integer, nullable=True)
+    response = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # start of the current request's lease on the key, see idempotency
+    reserved_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('username', 'key', name='uq_idempotency_key_username_key'),
+    )
+
+    def __repr__(self):
+        return f"<IdempotencyKey {self.key} for {self.username}>"
+
+
+# PaymentJob model tracks the background payment of an order
+class PaymentJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False, index=True)
+    checkout_item_id = db.Column(db.Integer, db.ForeignKey('checkout_item.id'), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='Queued', index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.String(255), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    order = db.relationship('Order', backref=db.backref('payment_jobs', lazy=True))
+    checkout_item = db.relationship('CheckoutItem')
+
+    def __repr__(self):
+        return f"<PaymentJob {self.id} for Order {self.order_id}>"
+
+    def serialize(self):
+        # Serialize the payment job instance into a dictionary format
+        return {
+            'id': self.id,
+            'order_id': self.order_id,
+            'status': self.status,
+            'order_status': self.order.status,
+            'attempts': self.attempts,
+            'error': self.last_error
+        }
+
+
+# DailySales model is the per day rollup of orders maintained by analytics
+class DailySales(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float(), nullable=False, default=0.0)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    cancellations = db.Column(db.Integer, nullable=False, default=0)
+    cancelled_revenue = db.Column(db.Float(), nullable=False, default=0.0)
+
+    def __repr__(self):
+        return f"<DailySales {self.day}>"
+
+    def serialize(self):
+        # Serialize the daily rollup, with the average basket derived from the totals
+        return {
+            'day': self.day.isoformat(),
+            'orders': self.orders,
+            'revenue': self.revenue,
+            'units': self.units,
+            'cancellations': self.cancellations,
+            'cancelled_revenue': self.cancelled_revenue,
+            'average_basket_size': self.units / self.orders if self.orders else 0,
+            'average_order_value': self.revenue / self.orders if self.orders else 0
+        }
+
+# DailyItemSales model is the per day and item rollup of units sold
+class DailyItemSales(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('item.id'), primary_key=True)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float(), nullable=False, default=0.0)
+
+    def __repr__(self):
+        return f"<DailyItemSales {self.day} item {self.item_id}>"
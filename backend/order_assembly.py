@@ -0,0 +1,129 @@
+from collections import defaultdict
+from sqlalchemy.orm import selectinload
+from models import Order, OrderItem, ArchivedOrder, ArchivedOrderItem
+
+# Builds the order listings returned by the orders and checkout endpoints.
+# Orders and their lines are loaded with a fixed number of batched queries
+# however many orders are listed.
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def load_orders(query, include_user=False):
+    # Run an Order query, eager loading the users in one extra query if needed
+    if include_user:
+        query = query.options(selectinload(Order.user))
+    return query.all()
+
+
+def page_size(args):
+    return min(max(args.get('limit', DEFAULT_PAGE_SIZE, type=int) or DEFAULT_PAGE_SIZE, 1), MAX_PAGE_SIZE)
+
+
+def load_order_page(query, args, include_user=False, model=Order):
+    # Keyset pagination over order ids, newest first. args are the request
+    # query arguments: cursor (last order id of the previous page), limit,
+    # status, user_id, min_total and max_total. model is Order or
+    # ArchivedOrder. Returns the orders and the cursor of the next page, None
+    # on the last page.
+    limit = page_size(args)
+    cursor = args.get('cursor', type=int)
+    status = args.get('status')
+    user_id = args.get('user_id', type=int)
+    min_total = args.get('min_total', type=float)
+    max_total = args.get('max_total', type=float)
+
+    if status:
+        query = query.filter(model.status == status)
+    if user_id is not None:
+        query = query.filter(model.user_id == user_id)
+    if min_total is not None:
+        query = query.filter(model.total_price >= min_total)
+    if max_total is not None:
+        query = query.filter(model.total_price <= max_total)
+    if cursor is not None:
+        query = query.filter(model.id < cursor)
+
+    # Fetch one extra row to know whether there is a next page
+    orders = load_orders(query.order_by(model.id.desc()).limit(limit + 1), include_user)
+    next_cursor = orders[limit - 1].id if len(orders) > limit else None
+    return orders[:limit], next_cursor
+
+
+def load_history_page(user_id, args):
+    # Page of a user's order history across the order table and the archive.
+    # Both are paged with the same cursor and merged by id, so archived
+    # orders show up as if they had never moved. Returns the serialized
+    # orders and the next cursor.
+    limit = page_size(args)
+    orders, next_cursor = load_order_page(Order.query.filter_by(user_id=user_id), args)
+    archived, archived_cursor = load_order_page(ArchivedOrder.query.filter_by(user_id=user_id), args,
+                                                model=ArchivedOrder)
+
+    merged = serialize_orders(orders) + serialize_orders(archived, line_model=ArchivedOrderItem)
+    merged.sort(key=lambda order: order['order_id'], reverse=True)
+    has_more = next_cursor is not None or archived_cursor is not None or len(merged) > limit
+    page = merged[:limit]
+    return page, page[-1]['order_id'] if has_more and page else None
+
+
+def load_order_lines(order_ids, line_model=OrderItem):
+    # Map each order id to its OrderItem (or ArchivedOrderItem) lines with one
+    # IN query. The lines carry a snapshot of their item, so the item table is
+    # not read.
+    lines = defaultdict(list)
+    if not order_ids:
+        return lines
+
+    order_items = (
+        line_model.query
+        .filter(line_model.order_id.in_(order_ids))
+        .order_by(line_model.id)
+        .all()
+    )
+    for order_item in order_items:
+        lines[order_item.order_id].append(order_item)
+    return lines
+
+
+def serialize_orders(orders, include_user=False, line_model=OrderItem):
+    # Shape used by the orders namespace (order_model)
+    lines = load_order_lines([order.id for order in orders], line_model)
+    orders_data = []
+    for order in orders:
+        order_data = {
+            'order_id': order.id,
+            'items': [{
+                'item_name': order_item.item_name,
+                'quantity': order_item.quantity,
+                'total_price': order_item.total_price,
+                'picture': order_item.picture
+            } for order_item in lines[order.id]],
+            'total_price': order.total_price,
+            'status': order.status
+        }
+        if include_user:
+            order_data['user'] = {
+                'username': order.user.username,
+                'user_id': order.user.id
+            }
+        orders_data.append(order_data)
+    return orders_data
+
+
+def serialize_checkout_orders(orders, line_model=OrderItem):
+    # Shape used by the checkout items endpoint
+    lines = load_order_lines([order.id for order in orders], line_model)
+    return [{
+        'id': order.id,
+        'total_price': order.total_price,
+        'status': order.status,
+        'items': [{
+            'id': order_item.item_id,
+            'name': order_item.item_name,
+            'price': order_item.unit_price,
+            'quantity': order_item.quantity,
+            'total_price': order_item.total_price
+        } for order_item in lines[order.id]]
+    } for order in orders]
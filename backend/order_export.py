@@ -0,0 +1,89 @@
+import csv
+import heapq
+import io
+import json
+from sqlalchemy import select
+from exts import db
+from models import Order, OrderItem, ArchivedOrder, ArchivedOrderItem
+
+# Streaming export of orders with their lines.
+# Rows are read from the database in batches and written out as they arrive,
+# so memory use does not depend on how many orders are exported. The order
+# tables and the archive are read side by side and merged by order id.
+
+EXPORT_BATCH_SIZE = 1000
+
+CSV_COLUMNS = ['order_id', 'user_id', 'status', 'order_total', 'item_id', 'item_name', 'quantity', 'line_total']
+
+
+def export_rows(status=None, after_id=None, before_id=None, since=None, until=None):
+    # Yield one row per order line, ordered by order id, archived orders included
+    filters = dict(status=status, after_id=after_id, before_id=before_id, since=since, until=until)
+    # an order is either in the order tables or in the archive, so its lines
+    # all come from the same source, in order
+    yield from heapq.merge(
+        _source_rows(Order, OrderItem, **filters),
+        _source_rows(ArchivedOrder, ArchivedOrderItem, **filters),
+        key=lambda row: row[0]
+    )
+
+
+def _source_rows(order_model, line_model, status, after_id, before_id, since, until):
+    query = (
+        select(order_model.id, order_model.user_id, order_model.status, order_model.total_price,
+               line_model.item_id, line_model.item_name, line_model.quantity, line_model.total_price)
+        .join(line_model, line_model.order_id == order_model.id)
+        .order_by(order_model.id, line_model.id)
+    )
+    if status:
+        query = query.where(order_model.status.in_(status))
+    if after_id is not None:
+        query = query.where(order_model.id > after_id)
+    if before_id is not None:
+        query = query.where(order_model.id < before_id)
+    if since is not None:
+        query = query.where(order_model.created_at >= since)
+    if until is not None:
+        query = query.where(order_model.created_at < until)
+
+    result = db.session.execute(query.execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE))
+    for partition in result.partitions():
+        yield from partition
+
+
+def export_ndjson(rows):
+    # One JSON object per order, its lines grouped from the consecutive rows
+    order = None
+    for order_id, user_id, status, order_total, item_id, item_name, quantity, line_total in rows:
+        if order is None or order['order_id'] != order_id:
+            if order is not None:
+                yield json.dumps(order) + '\n'
+            order = {
+                'order_id': order_id,
+                'user_id': user_id,
+                'status': status,
+                'total_price': order_total,
+                'items': []
+            }
+        order['items'].append({
+            'item_id': item_id,
+            'item_name': item_name,
+            'quantity': quantity,
+            'total_price': line_total
+        })
+    if order is not None:
+        yield json.dumps(order) + '\n'
+
+
+def export_csv(rows):
+    # A header line then one CSV line per order line
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    yield buffer.getvalue()
+
+    for row in rows:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(row)
+        yield buffer.getvalue()
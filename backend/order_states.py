@@ -0,0 +1,89 @@
+from sqlalchemy import update
+from sqlalchemy.orm.attributes import set_committed_value
+from exts import db
+from models import Order
+from events import publish_status_changed, publish_status_changed_many
+from analytics import record_orders_cancelled, record_payment_failed
+
+# Order status state machine with optimistic concurrency control.
+# Every status change is a compare-and-swap on the order's version column:
+# UPDATE ... WHERE id = ? AND version = ?. When two requests race on the same
+# order only one of them matches the row, the other gets a TransitionConflict
+# and no locks are held while waiting.
+
+PENDING = 'Pending'
+PROCESSED = 'Processed'
+CANCELLED = 'Cancelled'
+PAYMENT_FAILED = 'Payment Failed'
+
+# allowed status changes, every other status is final
+TRANSITIONS = {
+    PENDING: {PROCESSED, CANCELLED, PAYMENT_FAILED},
+}
+
+
+class InvalidTransition(Exception):
+    pass
+
+
+class TransitionConflict(Exception):
+    pass
+
+
+def can_transition(from_status, to_status):
+    return to_status in TRANSITIONS.get(from_status, set())
+
+
+def transition(order, to_status, commit=True):
+    # Move a loaded order to to_status if nobody changed it since it was read.
+    # Commits and publishes the status change event unless commit is False,
+    # in which case the caller does both.
+    from_status = order.status
+    if not can_transition(from_status, to_status):
+        raise InvalidTransition(f"Order {order.id} can't go from {from_status} to {to_status}")
+
+    result = db.session.execute(
+        update(Order)
+        .where(Order.id == order.id, Order.version == order.version)
+        .values(status=to_status, version=Order.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        raise TransitionConflict(f"Order {order.id} was changed by another request")
+
+    # Keep the loaded order in line with the row without flagging it as changed
+    set_committed_value(order, 'status', to_status)
+    set_committed_value(order, 'version', order.version + 1)
+
+    if to_status == CANCELLED:
+        record_orders_cancelled(1, order.total_price)
+    elif to_status == PAYMENT_FAILED:
+        record_payment_failed(order)
+
+    if commit:
+        db.session.commit()
+        publish_status_changed(order.id, to_status, from_status)
+    return order
+
+
+def bulk_transition(order_ids, from_status, to_status):
+    # Move every order of order_ids that is in from_status with one UPDATE,
+    # returns the ids that were changed. Commits and publishes the events.
+    if not can_transition(from_status, to_status):
+        raise InvalidTransition(f"Orders can't go from {from_status} to {to_status}")
+
+    totals = dict(db.session.execute(
+        update(Order)
+        .where(Order.id.in_(order_ids), Order.status == from_status)
+        .values(status=to_status, version=Order.version + 1)
+        .returning(Order.id, Order.total_price)
+        .execution_options(synchronize_session=False)
+    ).all())
+    if to_status == CANCELLED:
+        record_orders_cancelled(len(totals), sum(totals.values()))
+    db.session.commit()
+
+    updated = set(totals)
+
+    publish_status_changed_many([order_id for order_id in order_ids if order_id in updated], to_status, from_status)
+    return updated
@@ -1,8 +1,16 @@
 from flask_restx import Namespace, Resource, fields
-from flask import request
+from datetime import datetime
+from flask import request, Response, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import User, Order, OrderItem, Item, CartItem
+from models import User, Order, OrderItem, Item, ArchivedOrder, ArchivedOrderItem
+from sqlalchemy import select, literal, func
 from exts import db
+from idempotency import idempotent
+from cart import upsert_cart_items, add_cart_items
+from order_assembly import load_order_page, load_history_page, serialize_orders, MAX_PAGE_SIZE
+from order_export import export_rows, export_ndjson, export_csv
+from events import order_events, event_stream
+from order_states import transition, bulk_transition, InvalidTransition, TransitionConflict, PENDING, PROCESSED, CANCELLED
 
 #namespace for order-related operations
 orders_ns = Namespace('orders', description='Order related operations')
@@ -28,17 +36,51 @@ order_model = orders_ns.model(
     }
 )
 
+# query parameters of the paginated order lists
+order_page_params = {
+    'cursor': 'Id of the last order of the previous page (X-Next-Cursor header)',
+    'limit': f'Orders per page, at most {MAX_PAGE_SIZE}',
+    'status': 'Filter by order status',
+    'user_id': 'Filter by user ID',
+    'min_total': 'Minimum order total',
+    'max_total': 'Maximum order total'
+}
+
+# model for the bulk status change of orders by employees
+bulk_status_model = orders_ns.model(
+    'BulkOrderStatus', {
+        'order_ids': fields.List(fields.Integer, required=True, description='Order IDs'),
+        'status': fields.String(required=True, description='Processed or Cancelled')
+    }
+)
+
+MAX_BULK_ORDERS = 1000
+
 # model for the buy again request
 buy_again_model = orders_ns.model(
     'BuyAgain', {
-        'order_id': fields.Integer(required=True, description='Order ID')
+        'order_id': fields.Integer(description='Order ID'),
+        'order_ids': fields.List(fields.Integer, description='Order IDs, to buy several orders again')
     }
 )
 
+MAX_BUY_AGAIN_ORDERS = 50
+
+# parse an optional YYYY-MM-DD query argument, raises ValueError if malformed
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d') if value else None
+
+
+# headers of a paginated order list, the client passes X-Next-Cursor back as cursor
+def page_headers(next_cursor):
+    return {'X-Next-Cursor': str(next_cursor)} if next_cursor is not None else {}
+
+
 # Retrieve the current orders of the authenticated user
 @orders_ns.route('/')
 class UserOrders(Resource):
     @jwt_required()
+    @orders_ns.doc(params=order_page_params)
     @orders_ns.marshal_list_with(order_model)
     def get(self):
 
@@ -48,32 +90,15 @@ class UserOrders(Resource):
         if not user:
             orders_ns.abort(404, 'User not found')
 
-        # retrieve user's pending orders
-        orders = Order.query.filter_by(user_id=user.id, status='Pending').all()
-        orders_data = []
-        for order in orders:
-            order_items = OrderItem.query.filter_by(order_id=order.id).all()
-            items_data = []
-            for order_item in order_items:
-                item = Item.query.get(order_item.item_id)
-                items_data.append({
-                    'item_name': item.name,
-                    'quantity': order_item.quantity,
-                    'total_price': order_item.total_price,
-                    'picture' : item.picture
-                })
-            orders_data.append({
-                'order_id': order.id,
-                'items': items_data,
-                'total_price': order.total_price,
-                'status': order.status
-            })
-        return orders_data, 200
+        # retrieve a page of the user's pending orders
+        orders, next_cursor = load_order_page(Order.query.filter_by(user_id=user.id, status='Pending'), request.args)
+        return serialize_orders(orders), 200, page_headers(next_cursor)
 
 # Retrieve the order history of the authenticated user
 @orders_ns.route('/history')
 class UserOrderHistory(Resource):
     @jwt_required()
+    @orders_ns.doc(params=order_page_params)
     @orders_ns.marshal_list_with(order_model)
     def get(self):
 
@@ -83,38 +108,26 @@ class UserOrderHistory(Resource):
         if not user:
             orders_ns.abort(404, 'User not found')
 
-        # retrieve all orders
-        orders = Order.query.filter_by(user_id=user.id).all()
-        orders_data = []
-        for order in orders:
-            order_items = OrderItem.query.filter_by(order_id=order.id).all()
-            items_data = []
-            for order_item in order_items:
-                item = Item.query.get(order_item.item_id)
-                items_data.append({
-                    'item_name': item.name,
-                    'quantity': order_item.quantity,
-                    'total_price': order_item.total_price,
-                    'picture' : item.picture
-                })
-            orders_data.append({
-                'order_id': order.id,
-                'items': items_data,
-                'total_price': order.total_price,
-                'status': order.status
-            })
-        return orders_data, 200
+        # retrieve a page of all the user's orders, archived ones included
+        orders_data, next_cursor = load_history_page(user.id, request.args)
+        return orders_data, 200, page_headers(next_cursor)
 
 # Buy an item again based on a previous order
 @orders_ns.route('/buy_again')
 class BuyAgain(Resource):
     @jwt_required()
+    @idempotent('buy_again')
     @orders_ns.expect(buy_again_model)
     def post(self):
 
-        # get order ID from request
+        # get the order IDs from request, a single order_id or a list of order_ids
         data = request.get_json()
-        order_id = data.get('order_id')
+        order_ids = data.get('order_ids') or [data.get('order_id')]
+        if not isinstance(order_ids, list) or not all(isinstance(i, int) for i in order_ids):
+            orders_ns.abort(400, 'order_id or order_ids is required')
+        if len(order_ids) > MAX_BUY_AGAIN_ORDERS:
+            orders_ns.abort(400, f'At most {MAX_BUY_AGAIN_ORDERS} orders can be bought again at once')
+        order_ids = list(dict.fromkeys(order_ids))
 
         # get current user
         current_user = get_jwt_identity()
@@ -122,35 +135,41 @@ class BuyAgain(Resource):
         if not user:
             orders_ns.abort(404, 'User not found')
 
-        # Retrieve the order and associated items
-        order = Order.query.filter_by(id=order_id, user_id=user.id).first()
-        if not order:
+        # Check that every order belongs to the user, archived orders included
+        owned = {order_id for (order_id,) in db.session.query(Order.id).filter(
+            Order.id.in_(order_ids), Order.user_id == user.id).all()}
+        archived = {order_id for (order_id,) in db.session.query(ArchivedOrder.id).filter(
+            ArchivedOrder.id.in_(order_ids), ArchivedOrder.user_id == user.id).all()}
+        if len(owned | archived) != len(order_ids):
             orders_ns.abort(404, 'Order not found')
 
-        order_items = OrderItem.query.filter_by(order_id=order_id).all()
-        if not order_items:
-            orders_ns.abort(404, 'Order items not found')
-
-        # Add items to the cart
-        for order_item in order_items:
-            # Check if the item already exists in the cart
-            existing_cart_item = CartItem.query.filter_by(
-                user_id=user.id,
-                item_id=order_item.item_id
-            ).first()
-
-            if existing_cart_item:
-                # Update the quantity if item already exists
-                existing_cart_item.quantity += order_item.quantity
-                existing_cart_item.total_price = existing_cart_item.quantity * Item.query.get(order_item.item_id).price
+        # Add the items of each order to the cart with one upsert per order,
+        # all in one transaction
+        for order_id in order_ids:
+            if order_id in owned:
+                rows = (
+                    select(literal(user.id), OrderItem.item_id, func.sum(OrderItem.quantity))
+                    .join(Item, Item.id == OrderItem.item_id)
+                    .where(OrderItem.order_id == order_id)
+                    .group_by(OrderItem.item_id)
+                )
+                added = upsert_cart_items(rows)
             else:
-                # Add new item to the cart
-                new_cart_item = CartItem(
-                    user_id=user.id,
-                    item_id=order_item.item_id,
-                    quantity=order_item.quantity,
+                # The archive is a separate database, so its lines are read
+                # first and the items still sold are kept
+                quantities = dict(
+                    db.session.query(ArchivedOrderItem.item_id, func.sum(ArchivedOrderItem.quantity))
+                    .filter(ArchivedOrderItem.order_id == order_id)
+                    .group_by(ArchivedOrderItem.item_id)
+                    .all()
                 )
-                db.session.add(new_cart_item)
+                sold = {item_id for (item_id,) in db.session.query(Item.id).filter(Item.id.in_(quantities)).all()}
+                added = add_cart_items(user.id, {
+                    item_id: quantity for item_id, quantity in quantities.items() if item_id in sold
+                })
+            if added is None or added.rowcount == 0:
+                db.session.rollback()
+                orders_ns.abort(404, 'Order items not found')
 
         db.session.commit()
 
@@ -160,6 +179,7 @@ class BuyAgain(Resource):
 @orders_ns.route('/cancel')
 class CancelOrder(Resource):
     @jwt_required()
+    @idempotent('cancel')
     def post(self):
 
         # get order ID from request
@@ -175,39 +195,25 @@ class CancelOrder(Resource):
         if not order:
             orders_ns.abort(404, 'Order not found')
 
-        if order.status == 'Pending':
-            order.status = 'Cancelled'
-            db.session.commit()
-            return {'message': 'Order cancelled successfully'}, 200
-        else:
+        # Cancel the order if it is still pending and nobody changed it meanwhile
+        try:
+            transition(order, CANCELLED)
+        except InvalidTransition:
             return {'message': 'Order unable to be cancelled'}, 400
+        except TransitionConflict:
+            db.session.rollback()
+            return {'message': 'Order was changed by another request'}, 409
+        return {'message': 'Order cancelled successfully'}, 200
         
 # Retrieve all customer orders for employees
 @orders_ns.route('/employee/orders')
 class EmployeeOrders(Resource):
     @jwt_required()
+    @orders_ns.doc(params=order_page_params)
     @orders_ns.marshal_list_with(order_model)
     def get(self):
-        orders = Order.query.all()
-        orders_data = []
-        for order in orders:
-            order_items = OrderItem.query.filter_by(order_id=order.id).all()
-            items_data = []
-            for order_item in order_items:
-                item = Item.query.get(order_item.item_id)
-                items_data.append({
-                    'item_name': item.name,
-                    'quantity': order_item.quantity,
-                    'total_price': order_item.total_price,
-                    'picture' : item.picture
-                })
-            orders_data.append({
-                'order_id': order.id,
-                'items': items_data,
-                'total_price': order.total_price,
-                'status': order.status
-            })
-        return orders_data, 200
+        orders, next_cursor = load_order_page(Order.query, request.args)
+        return serialize_orders(orders), 200, page_headers(next_cursor)
     
 @orders_ns.route('/employee/orders/accept')
 class AcceptOrder(Resource):
@@ -221,19 +227,22 @@ class AcceptOrder(Resource):
         if not order:
             orders_ns.abort(404, 'Order not found')
 
-        # Process the order if it is still pending
-        if order.status == 'Pending':
-            order.status = 'Processed'
-            db.session.commit()
-            return {'message': 'Order processed successfully'}, 200
-        else:
+        # Process the order if it is still pending and nobody changed it meanwhile
+        try:
+            transition(order, PROCESSED)
+        except InvalidTransition:
             return {'message': 'Order already processed or unavailable'}, 400
+        except TransitionConflict:
+            db.session.rollback()
+            return {'message': 'Order was changed by another request'}, 409
+        return {'message': 'Order processed successfully'}, 200
         
 
  # cancel order by employees
 @orders_ns.route('/employee/orders/cancel')
 class CancelOrder(Resource):
     @jwt_required()
+    @idempotent('employee_cancel')
     def post(self):
 
         # get order ID from request
@@ -246,44 +255,127 @@ class CancelOrder(Resource):
             orders_ns.abort(404, 'Order not found')
 
 
-         # Cancel the order if it is still pending
-        if order.status == 'Pending':
-            order.status = 'Cancelled'
-            db.session.commit()
-            return {'message': 'Order cancelled successfully'}, 200
-        else:
+        # Cancel the order if it is still pending and nobody changed it meanwhile
+        try:
+            transition(order, CANCELLED)
+        except InvalidTransition:
             return {'message': 'Order unable to be cancelled'}, 400
+        except TransitionConflict:
+            db.session.rollback()
+            return {'message': 'Order was changed by another request'}, 409
+        return {'message': 'Order cancelled successfully'}, 200
+
+
+# accept or cancel many pending orders at once
+@orders_ns.route('/employee/orders/bulk')
+class BulkOrderStatus(Resource):
+    @jwt_required()
+    @idempotent('employee_bulk')
+    @orders_ns.expect(bulk_status_model)
+    def post(self):
+        data = request.get_json()
+        order_ids = data.get('order_ids')
+        status = data.get('status')
+
+        if status not in (PROCESSED, CANCELLED):
+            return {'message': 'Status must be Processed or Cancelled'}, 400
+        if not isinstance(order_ids, list) or not order_ids or not all(isinstance(i, int) for i in order_ids):
+            return {'message': 'order_ids must be a non empty list of order IDs'}, 400
+        if len(order_ids) > MAX_BULK_ORDERS:
+            return {'message': f'At most {MAX_BULK_ORDERS} orders can be changed at once'}, 400
+        order_ids = list(dict.fromkeys(order_ids))
+
+        # Change every pending order in one conditional UPDATE
+        updated = bulk_transition(order_ids, PENDING, status)
+
+        # Find out why the other orders were not changed
+        remaining = [order_id for order_id in order_ids if order_id not in updated]
+        current_status = dict(
+            db.session.query(Order.id, Order.status).filter(Order.id.in_(remaining)).all()
+        ) if remaining else {}
+
+        results = []
+        for order_id in order_ids:
+            if order_id in updated:
+                results.append({'order_id': order_id, 'result': 'updated', 'status': status})
+            elif order_id in current_status:
+                results.append({'order_id': order_id, 'result': 'not_pending', 'status': current_status[order_id]})
+            else:
+                results.append({'order_id': order_id, 'result': 'not_found', 'status': None})
+
+        return {'updated': len(updated), 'results': results}, 200
 
 
 # retrieve the order history for employees
 @orders_ns.route('/employee/orders/history')
 class EmployeeOrderHistory(Resource):
     @jwt_required() 
+    @orders_ns.doc(params=order_page_params)
     @orders_ns.marshal_list_with(order_model)
     def get(self):
 
         # Retrieve all cancelled or processed orders
-        orders = Order.query.filter(Order.status.in_(['Cancelled', 'Processed'])).all()
-        orders_data = []
-        for order in orders:
-            order_items = OrderItem.query.filter_by(order_id=order.id).all()
-            items_data = []
-            for order_item in order_items:
-                item = Item.query.get(order_item.item_id)
-                items_data.append({
-                    'item_name': item.name,
-                    'quantity': order_item.quantity,
-                    'total_price': order_item.total_price,
-                    'picture': item.picture
-                })
-            orders_data.append({
-                'order_id': order.id,
-                'user': {
-                    'username': order.user.username,
-                    'user_id': order.user.id
-                },
-                'items': items_data,
-                'total_price': order.total_price,
-                'status': order.status
-            })
-        return orders_data, 200
\ No newline at end of file
+        orders, next_cursor = load_order_page(Order.query.filter(Order.status.in_(['Cancelled', 'Processed'])),
+                                              request.args, include_user=True)
+        return serialize_orders(orders, include_user=True), 200, page_headers(next_cursor)
+
+
+# stream the order history with its lines for employees, as NDJSON or CSV
+@orders_ns.route('/employee/orders/export')
+class EmployeeOrderExport(Resource):
+    @jwt_required()
+    @orders_ns.doc(params={
+        'format': 'ndjson (default) or csv',
+        'status': 'Comma separated statuses, defaults to Cancelled,Processed',
+        'after_id': 'Only orders with a greater ID',
+        'before_id': 'Only orders with a smaller ID',
+        'since': 'Only orders created on or after this date (YYYY-MM-DD)',
+        'until': 'Only orders created before this date (YYYY-MM-DD)'
+    })
+    def get(self):
+        export_format = request.args.get('format', 'ndjson').lower()
+        if export_format not in ('ndjson', 'csv'):
+            return {'message': 'format must be ndjson or csv'}, 400
+
+        try:
+            since = parse_date(request.args.get('since'))
+            until = parse_date(request.args.get('until'))
+        except ValueError:
+            return {'message': 'since and until must be dates formatted as YYYY-MM-DD'}, 400
+
+        status = request.args.get('status', 'Cancelled,Processed')
+        rows = export_rows(
+            status=[value.strip() for value in status.split(',') if value.strip()],
+            after_id=request.args.get('after_id', type=int),
+            before_id=request.args.get('before_id', type=int),
+            since=since,
+            until=until
+        )
+
+        if export_format == 'csv':
+            body, mimetype = export_csv(rows), 'text/csv'
+        else:
+            body, mimetype = export_ndjson(rows), 'application/x-ndjson'
+
+        response = Response(stream_with_context(body), mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename=orders.{export_format}'
+        return response
+
+
+# push order created and status changed events to the employee dashboard
+@orders_ns.route('/employee/orders/events')
+class EmployeeOrderEvents(Resource):
+    # EventSource can't send headers, so the token may also be passed as ?jwt=
+    @jwt_required(locations=['headers', 'query_string'])
+    def get(self):
+        # Resume after the last event the client saw, sent by EventSource on reconnect
+        last_event_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+        try:
+            last_event_id = int(last_event_id) if last_event_id else None
+        except ValueError:
+            last_event_id = None
+
+        response = Response(event_stream(order_events, last_event_id), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
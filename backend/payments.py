@@ -0,0 +1,189 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import select, literal, func
+from sqlalchemy.exc import OperationalError
+from exts import db
+from models import PaymentJob, OrderItem, Item
+from events import publish_status_changed
+from sales import record_checkout_sales, forget_purchases
+from cart import upsert_cart_items
+from order_states import transition, InvalidTransition, TransitionConflict, PENDING, PAYMENT_FAILED
+
+# Background payment processing.
+# Checkout stores the order as Pending together with a queued PaymentJob and
+# returns straight away; a pool of workers then charges the card through a
+# payment adapter, retrying transient failures with backoff. When the payment
+# fails for good, what checkout booked for the order is taken back: the sales
+# counters, the purchase history and the sales rollups (see order_states),
+# and the items go back to the customer's cart.
+
+
+class PaymentError(Exception):
+    # Transient failure, the charge is retried
+    pass
+
+
+class PaymentDeclined(Exception):
+    # The card was refused, the charge is not retried
+    pass
+
+
+# Adapters implement charge() against a payment provider, card is a serialized
+# CheckoutItem. The idempotency key is the same for every attempt of a job so
+# providers can drop duplicate charges when a timed out attempt went through.
+class PaymentAdapter:
+    def charge(self, amount, card, idempotency_key):
+        raise NotImplementedError
+
+
+# Local adapter for development and tests: approves every card except the
+# ones ending in 0002 (declined) or 0119 (processing error)
+class MockPaymentAdapter(PaymentAdapter):
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.charges = {}
+
+    def charge(self, amount, card, idempotency_key):
+        if self.latency:
+            time.sleep(self.latency)
+        if card['ccNumber'].endswith('0002'):
+            raise PaymentDeclined('Card declined')
+        if card['ccNumber'].endswith('0119'):
+            raise PaymentError('Processing error')
+        self.charges.setdefault(idempotency_key, amount)
+        return idempotency_key
+
+
+PAYMENT_ADAPTERS = {
+    'mock': MockPaymentAdapter,
+}
+
+
+class PaymentQueue:
+    def __init__(self):
+        self.app = None
+        self.adapter = None
+        self._workers = None
+        self._calls = None
+
+    def init_app(self, app):
+        # Settings: PAYMENT_ADAPTER (name in PAYMENT_ADAPTERS or an adapter
+        # instance), PAYMENT_WORKERS, PAYMENT_TIMEOUT (seconds per attempt),
+        # PAYMENT_MAX_ATTEMPTS, PAYMENT_RETRY_BACKOFF (seconds, doubled per
+        # attempt) and PAYMENT_INLINE to process jobs inside the request.
+        self.app = app
+        adapter = app.config.get('PAYMENT_ADAPTER', 'mock')
+        self.adapter = PAYMENT_ADAPTERS[adapter]() if isinstance(adapter, str) else adapter
+        self.timeout = app.config.get('PAYMENT_TIMEOUT', 10)
+        self.max_attempts = app.config.get('PAYMENT_MAX_ATTEMPTS', 3)
+        self.backoff = app.config.get('PAYMENT_RETRY_BACKOFF', 1.0)
+        self.inline = app.config.get('PAYMENT_INLINE', False)
+
+        # Workers run jobs, calls run the adapter so a hung provider call can
+        # be timed out; both are bounded by the same concurrency limit
+        workers = app.config.get('PAYMENT_WORKERS', 4)
+        self._workers = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='payment-worker')
+        self._calls = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='payment-call')
+
+        self.requeue_unfinished()
+
+    def requeue_unfinished(self):
+        # Pick up jobs left queued or in progress by a previous run
+        with self.app.app_context():
+            try:
+                job_ids = [job_id for (job_id,) in db.session.query(PaymentJob.id).filter(
+                    PaymentJob.status.in_(['Queued', 'Processing'])).all()]
+            except OperationalError:
+                # Tables not created yet, e.g. before `flask db upgrade`
+                db.session.rollback()
+                return
+        for job_id in job_ids:
+            self.enqueue(job_id)
+
+    def enqueue(self, job_id, delay=0):
+        if self.inline:
+            self.process(job_id)
+        elif delay:
+            timer = threading.Timer(delay, self._workers.submit, args=(self._run, job_id))
+            timer.daemon = True
+            timer.start()
+        else:
+            self._workers.submit(self._run, job_id)
+
+    def _run(self, job_id):
+        with self.app.app_context():
+            try:
+                self.process(job_id)
+            except Exception as e:
+                db.session.rollback()
+                self.app.logger.error(f"Payment job {job_id} crashed: {str(e)}")
+
+    def process(self, job_id):
+        job = db.session.get(PaymentJob, job_id)
+        if job is None or job.status in ('Succeeded', 'Failed'):
+            return
+
+        job.status = 'Processing'
+        job.attempts += 1
+        db.session.commit()
+
+        future = self._calls.submit(self.adapter.charge, job.order.total_price,
+                                    job.checkout_item.serialize(), f"payment-job-{job.id}")
+        try:
+            future.result(timeout=self.timeout)
+        except PaymentDeclined as e:
+            self._fail(job, str(e))
+            return
+        except Exception as e:
+            # PaymentError, timeouts and unexpected adapter errors are retried
+            error = str(e) or 'Payment provider timed out'
+            if job.attempts >= self.max_attempts:
+                self._fail(job, error)
+                return
+            job.status = 'Queued'
+            job.last_error = error
+            db.session.commit()
+            self.enqueue(job.id, delay=self.backoff * 2 ** (job.attempts - 1))
+            return
+
+        job.status = 'Succeeded'
+        job.last_error = None
+        db.session.commit()
+
+    def _fail(self, job, error):
+        job.status = 'Failed'
+        job.last_error = error
+        # Fail the order too unless staff or the customer already moved it on
+        order = job.order
+        try:
+            transition(order, PAYMENT_FAILED, commit=False)
+            failed_order = True
+        except (InvalidTransition, TransitionConflict):
+            failed_order = False
+        if failed_order:
+            self._undo_checkout(order)
+        db.session.commit()
+        if failed_order:
+            publish_status_changed(job.order_id, PAYMENT_FAILED, PENDING)
+
+    def _undo_checkout(self, order):
+        # Runs in the transaction failing the order
+        lines = (
+            select(literal(order.user_id), OrderItem.item_id, func.sum(OrderItem.quantity))
+            .where(OrderItem.order_id == order.id)
+            .group_by(OrderItem.item_id)
+        )
+        sold = {item_id: quantity for _, item_id, quantity in db.session.execute(lines)}
+        record_checkout_sales({item_id: -quantity for item_id, quantity in sold.items()})
+        forget_purchases(order)
+        # items removed from the shop since are left out
+        upsert_cart_items(lines.join(Item, Item.id == OrderItem.item_id))
+
+    def shutdown(self):
+        if self._workers:
+            self._workers.shutdown(wait=False)
+            self._calls.shutdown(wait=False)
+
+
+payment_queue = PaymentQueue()
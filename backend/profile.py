@@ -1,8 +1,9 @@
 from flask_restx import Namespace, Resource, fields
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from flask import request, jsonify, send_from_directory
+from flask import request, jsonify, send_from_directory, current_app
 from models import User
 from exts import db
+from uploads import AVATAR_SIZES, avatar_filename
 import os
 
 
@@ -59,7 +60,17 @@ class UserProfile(Resource):
 # retrieve a profile picture by filename
 @profile_ns.route('/profile_picture/<filename>')
 class ProfilePicture(Resource):
+    @profile_ns.doc(params={'size': 'Avatar size in pixels (64, 128 or 256)'})
     def get(self, filename):
+        upload_dir = current_app.config['UPLOAD_FOLDER']
+
+        # Serve the resized avatar if one was requested and has been generated,
+        # otherwise fall back to the original upload
+        size = request.args.get('size', type=int)
+        if size in AVATAR_SIZES:
+            avatar = avatar_filename(filename, size)
+            if os.path.exists(os.path.join(upload_dir, avatar)):
+                return send_from_directory(upload_dir, avatar)
 
         # Serve the profile picture file from the static/uploads directory
-        return send_from_directory('static/uploads', filename)
\ No newline at end of file
+        return send_from_directory(upload_dir, filename)
\ No newline at end of file
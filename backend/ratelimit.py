@@ -0,0 +1,111 @@
+import threading
+import time
+from collections import defaultdict, deque
+from functools import wraps
+from flask import request, current_app
+
+
+# In-memory sliding window storage, one deque of hit timestamps per key.
+# It mirrors the small subset of Redis behaviour the limiter needs, so a
+# shared store can be swapped in later without touching the limiter itself.
+class MemoryStorage:
+    def __init__(self):
+        self._hits = defaultdict(deque)
+        self._lock = threading.Lock()
+
+    def hit(self, key, limit, window, now):
+        # Drop hits that fell out of the window, then record this one if allowed.
+        # Returns the number of seconds until the next hit is allowed, or 0.
+        with self._lock:
+            hits = self._hits[key]
+            while hits and hits[0] <= now - window:
+                hits.popleft()
+            if len(hits) >= limit:
+                return hits[0] + window - now
+            hits.append(now)
+            return 0
+
+    def reset(self, key=None):
+        with self._lock:
+            if key is None:
+                self._hits.clear()
+            else:
+                self._hits.pop(key, None)
+
+    def prune(self, window, now):
+        # Forget keys whose hits are all older than the window
+        with self._lock:
+            for key in [k for k, hits in self._hits.items() if not hits or hits[-1] <= now - window]:
+                del self._hits[key]
+
+
+# Sliding window limiter keyed by arbitrary strings (username, client IP, ...)
+class RateLimiter:
+    def __init__(self, storage=None, clock=time.monotonic):
+        self.storage = storage or MemoryStorage()
+        self.clock = clock
+        self.rejected = defaultdict(int)
+        self._calls = 0
+
+    def hit(self, scope, keys, limits):
+        # Check every key of a request, stop at the first one over its limit.
+        # limits maps a key kind to a (max hits, window in seconds) pair.
+        now = self.clock()
+        self._calls += 1
+        if self._calls % 1000 == 0:
+            self.storage.prune(max(window for _, window in limits.values()), now)
+
+        for kind, value in keys:
+            if not value or kind not in limits:
+                continue
+            limit, window = limits[kind]
+            retry_after = self.storage.hit(f"{scope}:{kind}:{value}", limit, window, now)
+            if retry_after:
+                self.rejected[f"{scope}:{kind}"] += 1
+                current_app.logger.warning(f"Rate limit exceeded for {scope} by {kind} {value}")
+                return retry_after
+        return 0
+
+    def metrics(self):
+        # Count of rejected requests per scope and key kind
+        return dict(self.rejected)
+
+    def reset(self):
+        self.storage.reset()
+        self.rejected.clear()
+
+
+limiter = RateLimiter()
+
+# Default limits per key kind, overridable per scope with RATELIMIT_<SCOPE> in the app config
+DEFAULT_LIMITS = {
+    'user': (5, 60),
+    'ip': (20, 60),
+}
+
+
+# Decorator for resource methods, rejects the request with 429 before the
+# handler runs so no database or password hashing work is done.
+# username_getter pulls the submitted username out of the request.
+def rate_limited(scope, username_getter):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not current_app.config.get('RATELIMIT_ENABLED', True):
+                return func(*args, **kwargs)
+
+            limits = current_app.config.get('RATELIMIT_' + scope.upper(), DEFAULT_LIMITS)
+            keys = [
+                ('user', username_getter()),
+                ('ip', request.remote_addr),
+            ]
+            retry_after = limiter.hit(scope, keys, limits)
+            if retry_after:
+                return (
+                    {'message': 'Too many attempts, please try again later'},
+                    429,
+                    {'Retry-After': str(int(retry_after) + 1)}
+                )
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
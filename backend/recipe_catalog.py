@@ -0,0 +1,177 @@
+import bisect
+import threading
+from collections import Counter, defaultdict
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from recipe_similarity import SimilarityIndex
+
+# Versioned in-memory cache of the recipe catalog.
+# The recipes are loaded and marshalled once, then served from memory until a
+# committed change to the recipe, recipe_item or item tables bumps the version
+# (item sales counter updates aside).
+# The next read rebuilds the catalog. The cache is per process.
+# Each snapshot also holds an inverted index from item id to the ids of the
+# recipes using the item (a posting list), for ingredient based lookups, and
+# each recipe's ingredients as a bitset (an int with one bit per item) to
+# compare them with a set of items in a few integer operations.
+
+WATCHED_TABLES = {'recipe', 'recipe_item', 'item'}
+
+# item columns left out of the catalog, writes to only these don't invalidate
+# it (the sales counter is updated by every checkout)
+UNCACHED_FIELDS = {'sales'}
+
+
+class CatalogSnapshot:
+    def __init__(self, version, recipes):
+        self.version = version
+        # recipes are the marshalled payloads, ordered by id
+        self.recipes = recipes
+        self.ids = [recipe['id'] for recipe in recipes]
+
+        postings = defaultdict(list)
+        self.item_bits = {}
+        self.masks = {}
+        for recipe in recipes:
+            mask = 0
+            for item in recipe['ingredients']:
+                postings[item['id']].append(recipe['id'])
+                mask |= 1 << self.item_bits.setdefault(item['id'], len(self.item_bits))
+            self.masks[recipe['id']] = mask
+        self.postings = dict(postings)
+        self._similarity = None
+
+    def get(self, recipe_id):
+        position = bisect.bisect_left(self.ids, recipe_id)
+        if position < len(self.ids) and self.ids[position] == recipe_id:
+            return self.recipes[position]
+        return None
+
+    def using_items(self, item_ids, match_all=False):
+        # Ids of the recipes using any (or all, with match_all) of item_ids with
+        # the number of those items each one uses, most matched items first
+        matched = Counter()
+        for item_id in set(item_ids):
+            matched.update(self.postings.get(item_id, ()))
+        if match_all:
+            required = len(set(item_ids))
+            matched = {recipe_id: count for recipe_id, count in matched.items() if count == required}
+        return sorted(matched.items(), key=lambda match: (-match[1], match[0]))
+
+    def items_mask(self, item_ids):
+        # Bitset of the items, items used by no recipe are left out
+        mask = 0
+        for item_id in item_ids:
+            bit = self.item_bits.get(item_id)
+            if bit is not None:
+                mask |= 1 << bit
+        return mask
+
+    def coverage(self, item_ids):
+        # (recipe id, ingredients among item_ids, ingredients) for every
+        # recipe using at least one of item_ids
+        have = self.items_mask(item_ids)
+        candidates = set()
+        for item_id in set(item_ids):
+            candidates.update(self.postings.get(item_id, ()))
+        return [(recipe_id, (self.masks[recipe_id] & have).bit_count(), self.masks[recipe_id].bit_count())
+                for recipe_id in candidates]
+
+    @property
+    def similarity(self):
+        # MinHash index of the ingredient sets, built on first use
+        if self._similarity is None:
+            self._similarity = SimilarityIndex({
+                recipe['id']: {item['id'] for item in recipe['ingredients']} for recipe in self.recipes
+            })
+        return self._similarity
+
+
+class RecipeCatalog:
+    def __init__(self, build):
+        # build returns the marshalled recipes ordered by id
+        self._build = build
+        self._lock = threading.Lock()
+        self._version = 0
+        self._snapshot = None
+
+    @property
+    def version(self):
+        return self._version
+
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+
+    def snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == self._version:
+            return snapshot
+
+        with self._lock:
+            version = self._version
+            if self._snapshot is not None and self._snapshot.version == version:
+                return self._snapshot
+            recipes = self._build()
+
+            # Keep it only if nothing was committed while it was being built
+            snapshot = CatalogSnapshot(version, recipes)
+            if version == self._version:
+                self._snapshot = snapshot
+            return snapshot
+
+
+def _touches_catalog(table):
+    return getattr(table, 'name', None) in WATCHED_TABLES
+
+
+def _changes_catalog(instance):
+    # Whether a modified instance changed anything besides uncached fields
+    state = inspect(instance)
+    return any(attr.history.has_changes() for attr in state.attrs if attr.key not in UNCACHED_FIELDS)
+
+
+def _statement_changes_catalog(orm_execute_state):
+    statement = orm_execute_state.statement
+    table = getattr(statement, 'table', None)
+    if not _touches_catalog(table):
+        return False
+    if table.name != 'item' or not orm_execute_state.is_update:
+        return True
+    # Fields set by the VALUES clause (_values, there is no public accessor)
+    # or by the rows of a bulk update by primary key
+    parameters = orm_execute_state.parameters
+    rows = parameters if isinstance(parameters, list) else [parameters] if parameters else []
+    fields = {getattr(column, 'key', column) for column in getattr(statement, '_values', None) or {}}
+    fields.update(key for row in rows for key in row if key != 'id')
+    return not fields or bool(fields - UNCACHED_FIELDS)
+
+
+def watch_session(catalog):
+    # Invalidate the catalog when a session that wrote to the watched tables
+    # commits, whether through the unit of work or an UPDATE/INSERT/DELETE
+    # statement. Writes are only noted until then, so a rollback leaves the
+    # cache alone.
+
+    @event.listens_for(Session, 'after_flush')
+    def note_flush(session, flush_context):
+        for instance in session.new | session.dirty | session.deleted:
+            if _touches_catalog(getattr(instance, '__table__', None)) and (
+                    instance not in session.dirty or _changes_catalog(instance)):
+                session.info['recipe_catalog_changed'] = True
+                return
+
+    @event.listens_for(Session, 'do_orm_execute')
+    def note_statement(orm_execute_state):
+        if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+            if _statement_changes_catalog(orm_execute_state):
+                orm_execute_state.session.info['recipe_catalog_changed'] = True
+
+    @event.listens_for(Session, 'after_commit')
+    def invalidate_on_commit(session):
+        if session.info.pop('recipe_catalog_changed', False):
+            catalog.invalidate()
+
+    @event.listens_for(Session, 'after_rollback')
+    def forget_on_rollback(session):
+        session.info.pop('recipe_catalog_changed', None)
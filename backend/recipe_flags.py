@@ -0,0 +1,124 @@
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import and_, event, exists, inspect, not_, select, update
+from sqlalchemy.orm import Session
+from exts import db
+from models import Item, Recipe, recipe_item
+
+# Recipe dietary flags derived from the ingredients.
+# A recipe is vegan (gluten-free) when it has ingredients and all of them
+# are vegan (gluten-free). Changes to items' flags, to recipe ingredients and
+# new recipes are noted on the session, and before it commits one UPDATE
+# recomputes the flags of the affected recipes only.
+
+# recipe flag: item flag
+DIETARY_FLAGS = {'is_vegan': 'vegan', 'is_gluten_free': 'glutenFree'}
+
+ALL_RECIPES = 'all'
+
+
+def _derived(item_flag):
+    # True when the recipe has ingredients and none of them lacks item_flag
+    ingredient = recipe_item.c.recipe_id == Recipe.id
+    lacking = and_(ingredient, recipe_item.c.item_id == Item.id, not_(getattr(Item, item_flag)))
+    return and_(exists().where(ingredient), not_(exists().where(lacking)))
+
+
+def refresh_recipe_flags(session=None, recipe_ids=None, item_ids=None):
+    # Recompute the flags of recipe_ids and of the recipes using item_ids,
+    # or of every recipe when both are None. The caller commits.
+    session = session or db.session
+    stmt = update(Recipe).values({
+        recipe_flag: _derived(item_flag) for recipe_flag, item_flag in DIETARY_FLAGS.items()
+    })
+    if recipe_ids is not None or item_ids is not None:
+        affected = Recipe.id.in_(recipe_ids or [])
+        if item_ids:
+            affected = affected | Recipe.id.in_(
+                select(recipe_item.c.recipe_id).where(recipe_item.c.item_id.in_(item_ids)))
+        stmt = stmt.where(affected)
+    return session.execute(stmt.execution_options(synchronize_session=False)).rowcount
+
+
+def _note(session, recipe_ids=(), item_ids=()):
+    changes = session.info.setdefault('recipe_flags_changed', {'recipes': set(), 'items': set()})
+    if changes != ALL_RECIPES:
+        changes['recipes'].update(recipe_ids)
+        changes['items'].update(item_ids)
+
+
+def _note_all(session):
+    session.info['recipe_flags_changed'] = ALL_RECIPES
+
+
+def _changed(instance, fields):
+    state = inspect(instance)
+    return any(state.attrs[field].history.has_changes() for field in fields)
+
+
+# Mark the recipes affected by a flush or statement, refresh them before commit
+@event.listens_for(Session, 'after_flush')
+def note_flush(session, flush_context):
+    for instance in session.new | session.dirty:
+        if isinstance(instance, Recipe) and (
+                instance in session.new or _changed(instance, ['items', *DIETARY_FLAGS])):
+            _note(session, recipe_ids=[instance.id])
+        elif isinstance(instance, Item) and instance not in session.new \
+                and _changed(instance, DIETARY_FLAGS.values()):
+            _note(session, item_ids=[instance.id])
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def note_statement(orm_execute_state):
+    # Statements on the ingredient table affect the recipes in their
+    # parameters, or any recipe when there are none to go by; item updates
+    # only matter when they set a dietary flag
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    session = orm_execute_state.session
+    table = getattr(getattr(orm_execute_state.statement, 'table', None), 'name', None)
+    parameters = orm_execute_state.parameters
+    rows = parameters if isinstance(parameters, list) else [parameters] if parameters else []
+
+    if table == 'recipe_item':
+        if rows and all('recipe_id' in row for row in rows):
+            _note(session, recipe_ids=[row['recipe_id'] for row in rows])
+        else:
+            _note_all(session)
+    elif table == 'item' and orm_execute_state.is_update:
+        sets_flags = any(flag in row for row in rows for flag in DIETARY_FLAGS.values())
+        if sets_flags and all('id' in row for row in rows):
+            _note(session, item_ids=[row['id'] for row in rows])
+        elif sets_flags or _sets_flags(orm_execute_state.statement):
+            _note_all(session)
+
+
+def _sets_flags(statement):
+    # Whether the UPDATE statement's VALUES set an item dietary flag
+    # (_values is where SQLAlchemy keeps them, there is no public accessor)
+    values = getattr(statement, '_values', None) or {}
+    return any(getattr(column, 'key', column) in DIETARY_FLAGS.values() for column in values)
+
+
+@event.listens_for(Session, 'before_commit')
+def refresh_before_commit(session):
+    session.flush()
+    changes = session.info.pop('recipe_flags_changed', None)
+    if changes == ALL_RECIPES:
+        refresh_recipe_flags(session)
+    elif changes:
+        refresh_recipe_flags(session, changes['recipes'], changes['items'])
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_on_rollback(session):
+    session.info.pop('recipe_flags_changed', None)
+
+
+@click.command('refresh-recipe-flags')
+@with_appcontext
+def refresh_recipe_flags_command():
+    """Recompute the vegan and gluten-free flags of every recipe."""
+    changed = refresh_recipe_flags()
+    db.session.commit()
+    click.echo(f'{changed} recipe flags recomputed.')
@@ -0,0 +1,57 @@
+import re
+from sqlalchemy import text
+from exts import db
+
+# Full-text recipe search on the recipe_fts FTS5 index.
+# The index covers the recipe names, descriptions and ingredient names and is
+# kept up to date by triggers (see the 6e3a1c9d4f58 migration). Results are
+# ranked with BM25, and the vegan and gluten-free filters are columns of the
+# index, so a search is a single query on it.
+
+SEARCH_INDEX = 'recipe_fts'
+
+# BM25 weights of the name, description and ingredients columns
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+INGREDIENTS_WEIGHT = 4.0
+
+
+def match_expression(term):
+    # Turn free text into an FTS5 query matching every word as a prefix, the
+    # words are quoted so user input is never read as query syntax
+    words = re.findall(r'\w+', term)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def _filters(vegan, gluten_free):
+    conditions = f'{SEARCH_INDEX} MATCH :match'
+    if vegan:
+        conditions += ' AND is_vegan = 1'
+    if gluten_free:
+        conditions += ' AND is_gluten_free = 1'
+    return conditions
+
+
+def search_recipes(match, vegan=False, gluten_free=False, page=1, per_page=20, count=False):
+    # Returns the ids of the page of recipes matching the match expression,
+    # best first, whether there is a next page, and the total number of
+    # matches when count is True (None otherwise)
+    conditions = _filters(vegan, gluten_free)
+    rows = db.session.execute(text(
+        f'SELECT rowid FROM {SEARCH_INDEX} WHERE {conditions} '
+        f'ORDER BY bm25({SEARCH_INDEX}, {NAME_WEIGHT}, {DESCRIPTION_WEIGHT}, {INGREDIENTS_WEIGHT}), rowid '
+        'LIMIT :limit OFFSET :offset'
+    ), {'match': match, 'limit': per_page + 1, 'offset': (page - 1) * per_page}).scalars().all()
+
+    total = None
+    if count:
+        total = db.session.execute(text(
+            f'SELECT count(*) FROM {SEARCH_INDEX} WHERE {conditions}'
+        ), {'match': match}).scalar()
+    return rows[:per_page], len(rows) > per_page, total
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    # Keep the search index and its shadow tables out of autogenerated
+    # migrations, they are not models
+    return not (type_ == 'table' and name.startswith(SEARCH_INDEX))
@@ -0,0 +1,79 @@
+import random
+from collections import defaultdict
+
+# Similar recipes by ingredients with MinHash and locality-sensitive hashing.
+# Each recipe's ingredient set gets a MinHash signature; the signature is cut
+# into bands and recipes sharing a band land in the same bucket. A lookup
+# only compares a recipe with the recipes sharing one of its buckets, and
+# checks those candidates with the exact Jaccard similarity of their sets.
+# With 16 bands of 4 rows, recipes with a similarity of 0.5 are found with
+# a probability above 0.6 and those of 0.7 above 0.97. Small catalogs, where
+# LSH would miss the loosely similar recipes, are compared exactly.
+
+NUM_PERMUTATIONS = 64
+BANDS = 16
+ROWS = NUM_PERMUTATIONS // BANDS
+
+# up to this many recipes a lookup compares all of them
+EXACT_SCAN_LIMIT = 2000
+
+# hash functions h(x) = (a * x + b) mod PRIME, fixed so signatures are stable
+PRIME = (1 << 61) - 1
+_random = random.Random(1)
+HASHES = [(_random.randrange(1, PRIME), _random.randrange(0, PRIME)) for _ in range(NUM_PERMUTATIONS)]
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+def item_hashes(item):
+    return [(a * item + b) % PRIME for a, b in HASHES]
+
+
+def signature(items, hashes=None):
+    # MinHash signature of a non-empty set of item ids, the element-wise
+    # minimum of the items' hashes. hashes caches them across recipes.
+    if hashes is None:
+        hashes = {}
+    for item in items:
+        if item not in hashes:
+            hashes[item] = item_hashes(item)
+    return tuple(map(min, zip(*[hashes[item] for item in items])))
+
+
+class SimilarityIndex:
+    def __init__(self, ingredient_sets):
+        # ingredient_sets maps recipe ids to their sets of item ids
+        self.ingredient_sets = ingredient_sets
+        self.buckets = defaultdict(list)
+        self.bands = {}
+        hashes = {}
+        for recipe_id, items in ingredient_sets.items():
+            if not items:
+                continue
+            recipe_signature = signature(items, hashes)
+            bands = [(band, recipe_signature[band * ROWS:(band + 1) * ROWS]) for band in range(BANDS)]
+            self.bands[recipe_id] = bands
+            for key in bands:
+                self.buckets[key].append(recipe_id)
+
+    def candidates(self, recipe_id):
+        if len(self.bands) <= EXACT_SCAN_LIMIT:
+            return set(self.bands) - {recipe_id}
+        candidates = set()
+        for key in self.bands.get(recipe_id, ()):
+            candidates.update(self.buckets[key])
+        candidates.discard(recipe_id)
+        return candidates
+
+    def similar(self, recipe_id, limit=10, min_similarity=0.0):
+        # (recipe id, Jaccard similarity) of the most similar recipes, best first
+        items = self.ingredient_sets.get(recipe_id, set())
+        matches = []
+        for candidate in self.candidates(recipe_id):
+            similarity = jaccard(items, self.ingredient_sets[candidate])
+            if similarity > 0 and similarity >= min_similarity:
+                matches.append((candidate, similarity))
+        matches.sort(key=lambda match: (-match[1], match[0]))
+        return matches[:limit]
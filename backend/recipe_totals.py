@@ -0,0 +1,110 @@
+import click
+import numpy as np
+from flask.cli import with_appcontext
+from sqlalchemy import event, inspect, select, update
+from sqlalchemy.orm import Session
+from exts import db
+from models import Item, Recipe, recipe_item
+
+# Precomputed recipe cost and calorie totals.
+# The totals are the product of the recipe x item ingredient matrix with the
+# item cost and calorie vectors. The matrix is sparse, so
+# it is kept as its (recipe, item) pairs and the product is a weighted
+# bincount over them: one pass in NumPy for the whole catalog. Totals are
+# stored on Recipe, so they can be sorted and filtered on, and recomputed
+# before a commit that changes item prices, calories or recipe ingredients.
+
+PRICE_FIELDS = ('price', 'calorie')
+
+
+def item_cost(item):
+    # What an ingredient adds to a recipe's cost, item is a mapping of the
+    # item's columns. Item.price is the sale price, the discount is already
+    # applied to it.
+    return item['price']
+
+
+def compute_recipe_totals(session):
+    # Returns the recipe ids with their total costs and calories as arrays
+    recipe_ids = np.array(session.scalars(select(Recipe.id).order_by(Recipe.id)).all(), dtype=np.int64)
+    items = session.execute(select(Item.id, Item.price, Item.calorie)).mappings().all()
+    pairs = session.execute(select(recipe_item.c.recipe_id, recipe_item.c.item_id)).all()
+    # (np.array on the rows themselves is an order of magnitude slower)
+    pair_recipes = np.fromiter((recipe_id for recipe_id, _ in pairs), dtype=np.int64, count=len(pairs))
+    pair_items = np.fromiter((item_id for _, item_id in pairs), dtype=np.int64, count=len(pairs))
+
+    item_ids = np.array([item['id'] for item in items], dtype=np.int64)
+    order = np.argsort(item_ids)
+    item_ids = item_ids[order]
+    prices = np.array([item_cost(item) for item in items], dtype=np.float64)[order]
+    calories = np.array([item['calorie'] for item in items], dtype=np.float64)[order]
+
+    rows = np.searchsorted(recipe_ids, pair_recipes)
+    columns = np.searchsorted(item_ids, pair_items)
+    costs = np.bincount(rows, weights=prices[columns], minlength=len(recipe_ids))
+    total_calories = np.bincount(rows, weights=calories[columns], minlength=len(recipe_ids))
+    return recipe_ids, np.round(costs, 2), total_calories.astype(np.int64)
+
+
+def refresh_recipe_totals(session=None):
+    # Store the recomputed totals of the recipes whose totals changed, returns
+    # their number. The caller commits.
+    session = session or db.session
+    recipe_ids, costs, calories = compute_recipe_totals(session)
+    current = dict(
+        (recipe_id, (total_cost, total_calories)) for recipe_id, total_cost, total_calories
+        in session.execute(select(Recipe.id, Recipe.total_cost, Recipe.total_calories))
+    )
+    changed = [
+        {'id': recipe_id, 'total_cost': cost, 'total_calories': calorie}
+        for recipe_id, cost, calorie in zip(recipe_ids.tolist(), costs.tolist(), calories.tolist())
+        if current.get(recipe_id) != (cost, calorie)
+    ]
+    if changed:
+        session.execute(update(Recipe), changed)
+    return len(changed)
+
+
+def _changes_totals(instance):
+    if isinstance(instance, Recipe):
+        return inspect(instance).attrs['items'].history.has_changes()
+    if isinstance(instance, Item):
+        return any(inspect(instance).attrs[field].history.has_changes() for field in PRICE_FIELDS)
+    return False
+
+
+# Mark sessions whose flushes change the totals, and refresh them before commit
+@event.listens_for(Session, 'after_flush')
+def note_flush(session, flush_context):
+    if any(isinstance(instance, (Recipe, Item)) for instance in session.new | session.deleted) \
+            or any(_changes_totals(instance) for instance in session.dirty):
+        session.info['recipe_totals_changed'] = True
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def note_statement(orm_execute_state):
+    # Statements on the ingredient table, item price updates go through the ORM
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        if getattr(getattr(orm_execute_state.statement, 'table', None), 'name', None) == 'recipe_item':
+            orm_execute_state.session.info['recipe_totals_changed'] = True
+
+
+@event.listens_for(Session, 'before_commit')
+def refresh_before_commit(session):
+    session.flush()
+    if session.info.pop('recipe_totals_changed', False):
+        refresh_recipe_totals(session)
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_on_rollback(session):
+    session.info.pop('recipe_totals_changed', None)
+
+
+@click.command('refresh-recipe-totals')
+@with_appcontext
+def refresh_recipe_totals_command():
+    """Recompute the recipe cost and calorie totals."""
+    changed = refresh_recipe_totals()
+    db.session.commit()
+    click.echo(f'{changed} recipe totals updated.')
@@ -1,14 +1,23 @@
+import bisect
 from flask import request
-from flask_restx import Namespace, Resource, fields
-from models import Recipe, Item
+from flask_restx import Namespace, Resource, fields, marshal
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from models import Recipe, Item, User, CartItem
 from exts import db
+from recipe_catalog import RecipeCatalog, watch_session
+from recipe_search import match_expression, search_recipes
+from meal_plans import plan_meals, DEFAULT_DAYS, MAX_DAYS, CALORIE_TOLERANCE
+from cart import add_cart_items, add_recipe_ingredients
+from idempotency import idempotent
 
 
 # namespace for recipes-related operations
 recipes_ns = Namespace('recipes', description='Recipe operations')
 
 # model for an item, which is part of a recipe
-item_model = recipes_ns.model('Item', {
+# recipe ingredients leave out the sales counter, which changes on every
+# checkout, so the cached catalog doesn't have to
+ingredient_model = recipes_ns.model('Ingredient', {
     'id': fields.Integer(readonly=True),
     'name': fields.String(required=True),
     'price': fields.Float(required=True),
@@ -16,7 +25,10 @@ item_model = recipes_ns.model('Item', {
     'vegan': fields.Boolean(required=True),
     'glutenFree': fields.Boolean(required=True),
     'discount': fields.Float(required=True),
-    'picture': fields.String(),
+    'picture': fields.String()
+})
+
+item_model = recipes_ns.inherit('Item', ingredient_model, {
     'sales': fields.Integer(required=True)
 })
 
@@ -29,62 +41,421 @@ recipe_model = recipes_ns.model('Recipe', {
     'description': fields.String(),
     'is_vegan': fields.Boolean(),
     'is_gluten_free': fields.Boolean(),
-    'ingredients': fields.List(fields.Nested(item_model))
+    'total_cost': fields.Float(),
+    'total_calories': fields.Integer(),
+    'ingredients': fields.List(fields.Nested(ingredient_model))
 })
 
 
+# recipes are marshalled once and served from memory, see recipe_catalog
+def build_catalog():
+    recipes = Recipe.query.order_by(Recipe.id).all()
+    return marshal([recipe.serialize() for recipe in recipes], recipe_model)
+
+
+recipe_catalog = RecipeCatalog(build_catalog)
+watch_session(recipe_catalog)
+
+DEFAULT_PER_PAGE = 20
+MAX_PER_PAGE = 200
+
+
+# sort orders of the recipe list, a leading - sorts descending
+RECIPE_SORTS = {'cost': 'total_cost', 'calories': 'total_calories', 'name': 'name'}
+
+
 # class to list all the recipes 
 @recipes_ns.route('')
 class RecipeList(Resource):
-    @recipes_ns.marshal_list_with(recipe_model)
+    @recipes_ns.response(200, 'Success', [recipe_model])
+    @recipes_ns.doc(params={
+        'page': 'Page number, all recipes are returned when neither page nor cursor is given',
+        'per_page': 'Recipes per page, 20 by default',
+        'cursor': 'Id of the last recipe of the previous page, returned in X-Next-Cursor',
+        'sort': 'cost, calories or name, prefixed with - for descending order, e.g. cost for the cheapest first',
+        'max_cost': 'Highest total cost',
+        'max_calories': 'Highest total calories, e.g. 600'
+    })
     def get(self):
         """Get all recipes"""
+        catalog = recipe_catalog.snapshot()
+        etag = f'"recipes-{catalog.version}"'
+        if etag in request.headers.get('If-None-Match', ''):
+            return None, 304, {'ETag': etag}
+
+        page = request.args.get('page', type=int)
+        cursor = request.args.get('cursor', type=int)
+        per_page = min(max(request.args.get('per_page', DEFAULT_PER_PAGE, type=int), 1), MAX_PER_PAGE)
+        sort = request.args.get('sort', '')
+        max_cost = request.args.get('max_cost', type=float)
+        max_calories = request.args.get('max_calories', type=int)
+        if sort and sort.lstrip('-') not in RECIPE_SORTS:
+            recipes_ns.abort(400, 'sort must be one of ' + ', '.join(RECIPE_SORTS))
+        if sort and cursor is not None:
+            recipes_ns.abort(400, 'cursor pages recipes by id, use page with sort')
+
+        recipes = catalog.recipes
+        if max_cost is not None or max_calories is not None:
+            recipes = [recipe for recipe in recipes
+                       if (max_cost is None or recipe['total_cost'] <= max_cost)
+                       and (max_calories is None or recipe['total_calories'] <= max_calories)]
+        if sort:
+            field = RECIPE_SORTS[sort.lstrip('-')]
+            recipes = sorted(recipes, key=lambda recipe: recipe[field], reverse=sort.startswith('-'))
+        headers = {'ETag': etag, 'X-Total-Count': str(len(recipes))}
+
+        # serve the recipes, whole or a page of them
+        if cursor is not None or (page is None and not sort and 'per_page' in request.args):
+            ids = catalog.ids if recipes is catalog.recipes else [recipe['id'] for recipe in recipes]
+            start = bisect.bisect_right(ids, cursor) if cursor is not None else 0
+            if start + per_page < len(recipes):
+                headers['X-Next-Cursor'] = str(ids[start + per_page - 1])
+            recipes = recipes[start:start + per_page]
+        elif page is not None or 'per_page' in request.args:
+            page = max(page or 1, 1)
+            start = (page - 1) * per_page
+            if start + per_page < len(recipes):
+                headers['X-Next-Page'] = str(page + 1)
+            recipes = recipes[start:start + per_page]
+        return recipes, 200, headers
+
+
+# recipe found by its ingredients, with the number of selected items it uses
+recipe_match_model = recipes_ns.inherit('RecipeMatch', recipe_model, {
+    'matched_items': fields.Integer()
+})
+
+
+def parse_ids(value):
+    # Comma separated ids, e.g. 1,2,3
+    try:
+        return [int(part) for part in value.split(',') if part.strip()]
+    except ValueError:
+        recipes_ns.abort(400, 'ids must be a comma separated list of item IDs')
+
 
-        # serialize recipes and return them
-        return [recipe.serialize() for recipe in Recipe.query.all()]
+# class to find recipes that use some items, e.g. meal ideas for chicken
+@recipes_ns.route('/by-items')
+class RecipesByItems(Resource):
+    @recipes_ns.response(200, 'Success', [recipe_match_model])
+    @recipes_ns.doc(params={
+        'ids': 'Comma separated item IDs',
+        'match': 'any (default) for recipes using any of the items, all for recipes using every item',
+        'page': 'Page number',
+        'per_page': 'Recipes per page'
+    })
+    def get(self):
+        """Get recipes using the given items, those using the most of them first"""
+        item_ids = parse_ids(request.args.get('ids', ''))
+        if not item_ids:
+            recipes_ns.abort(400, 'ids is required')
+        match = request.args.get('match', 'any').lower()
+        if match not in ('any', 'all'):
+            recipes_ns.abort(400, 'match must be any or all')
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', DEFAULT_PER_PAGE, type=int), 1), MAX_PER_PAGE)
+
+        # look the items up in the catalog's posting lists
+        catalog = recipe_catalog.snapshot()
+        matches = catalog.using_items(item_ids, match_all=match == 'all')
+        start = (page - 1) * per_page
+        headers = {'X-Total-Count': str(len(matches))}
+        if start + per_page < len(matches):
+            headers['X-Next-Page'] = str(page + 1)
+        return [dict(catalog.get(recipe_id), matched_items=matched)
+                for recipe_id, matched in matches[start:start + per_page]], 200, headers
+
+
+# recipe matched against the cart, with the share of its ingredients in the
+# cart and the ingredients still to buy
+cart_match_model = recipes_ns.inherit('CartMatch', recipe_model, {
+    'coverage': fields.Float(),
+    'missing_ingredients': fields.List(fields.Nested(ingredient_model))
+})
+
+
+# class to find what the user can cook with the items in their cart
+@recipes_ns.route('/from-cart')
+class RecipesFromCart(Resource):
+    @jwt_required()
+    @recipes_ns.response(200, 'Success', [cart_match_model])
+    @recipes_ns.doc(params={
+        'min_coverage': 'Smallest share of a recipe\'s ingredients in the cart, from 0 to 1',
+        'page': 'Page number',
+        'per_page': 'Recipes per page'
+    })
+    def get(self):
+        """Get recipes using items in the cart, the best covered first"""
+        user = User.query.filter_by(username=get_jwt_identity()).first()
+        if not user:
+            return {'message': 'User not found'}, 404
+        min_coverage = request.args.get('min_coverage', 0.0, type=float)
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', DEFAULT_PER_PAGE, type=int), 1), MAX_PER_PAGE)
+
+        # the cart's item ids, then their coverage of each recipe from the catalog bitsets
+        cart = set(db.session.scalars(db.select(CartItem.item_id).filter_by(user_id=user.id)))
+        catalog = recipe_catalog.snapshot()
+        matches = [(recipe_id, have / total, total - have)
+                   for recipe_id, have, total in catalog.coverage(cart)
+                   if have / total >= min_coverage]
+        matches.sort(key=lambda match: (-match[1], match[2], match[0]))
+
+        start = (page - 1) * per_page
+        headers = {'X-Total-Count': str(len(matches))}
+        if start + per_page < len(matches):
+            headers['X-Next-Page'] = str(page + 1)
+
+        results = []
+        for recipe_id, coverage, _ in matches[start:start + per_page]:
+            recipe = catalog.get(recipe_id)
+            results.append(dict(recipe, coverage=coverage, missing_ingredients=[
+                item for item in recipe['ingredients'] if item['id'] not in cart
+            ]))
+        return results, 200, headers
+
+
+# model for the meal plan constraints
+meal_plan_request_model = recipes_ns.model('MealPlanRequest', {
+    'days': fields.Integer(description='Number of recipes, one per day, 7 by default'),
+    'budget': fields.Float(description='Highest cost of the shopping list'),
+    'daily_calories': fields.Integer(
+        description=f'Calorie target of each recipe, recipes within {CALORIE_TOLERANCE:.0%} of it are planned'),
+    'vegan': fields.Boolean(default=False),
+    'gluten_free': fields.Boolean(default=False),
+    'add_to_cart': fields.Boolean(default=False, description='Add the shopping list to the cart')
+})
+
+shopping_line_model = recipes_ns.model('ShoppingLine', {
+    'item_id': fields.Integer(),
+    'name': fields.String(),
+    'quantity': fields.Integer(),
+    'unit_price': fields.Float(),
+    'recipes': fields.Integer(description='Number of planned recipes using the item')
+})
+
+meal_plan_model = recipes_ns.model('MealPlan', {
+    'recipes': fields.List(fields.Nested(recipe_model)),
+    'shopping_list': fields.List(fields.Nested(shopping_line_model)),
+    'total_cost': fields.Float(),
+    'total_calories': fields.Integer(),
+    'added_to_cart': fields.Boolean()
+})
+
+
+# JSON true and false are ints in Python, they are not accepted as numbers
+def is_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+# class to plan a week of meals and optionally fill the cart with its ingredients
+@recipes_ns.route('/meal-plan')
+class MealPlan(Resource):
+    @jwt_required()
+    @idempotent('meal_plan')
+    @recipes_ns.expect(meal_plan_request_model)
+    @recipes_ns.response(200, 'Success', meal_plan_model)
+    def post(self):
+        """Plan meals within a budget and calorie target, reusing ingredients"""
+        user = User.query.filter_by(username=get_jwt_identity()).first()
+        if not user:
+            return {'message': 'User not found'}, 404
+
+        data = request.get_json() or {}
+        days = data.get('days', DEFAULT_DAYS)
+        budget = data.get('budget')
+        daily_calories = data.get('daily_calories')
+        if not is_integer(days) or not 1 <= days <= MAX_DAYS:
+            recipes_ns.abort(400, f'days must be between 1 and {MAX_DAYS}')
+        if budget is not None and (not is_number(budget) or budget < 0):
+            recipes_ns.abort(400, 'budget must be a positive number')
+        if daily_calories is not None and (not is_integer(daily_calories) or daily_calories <= 0):
+            recipes_ns.abort(400, 'daily_calories must be a positive integer')
+
+        recipes, shopping = plan_meals(recipe_catalog.snapshot(), days, budget, daily_calories,
+                                       bool(data.get('vegan')), bool(data.get('gluten_free')))
+        if len(recipes) < days:
+            return {'message': f'Only {len(recipes)} recipes fit the constraints, {days} are needed'}, 422
+
+        # Add the whole shopping list to the cart in one statement
+        added = bool(data.get('add_to_cart'))
+        if added:
+            try:
+                add_cart_items(user.id, {line['item_id']: line['quantity'] for line in shopping})
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                return {'message': 'Failed to add the meal plan to the cart', 'error': str(e)}, 500
+
+        return {
+            'recipes': recipes,
+            'shopping_list': shopping,
+            'total_cost': round(sum(line['unit_price'] * line['quantity'] for line in shopping), 2),
+            'total_calories': sum(recipe['total_calories'] for recipe in recipes),
+            'added_to_cart': added
+        }, 200
+
+
+MAX_CART_RECIPES = 50
+
+recipe_quantity_model = recipes_ns.model('RecipeQuantity', {
+    'recipe_id': fields.Integer(required=True),
+    'quantity': fields.Integer(description='Times to add the recipe, 1 by default')
+})
+
+recipe_to_cart_model = recipes_ns.model('RecipeToCart', {
+    'quantity': fields.Integer(description='Times to add the recipe, 1 by default')
+})
+
+recipes_to_cart_model = recipes_ns.model('RecipesToCart', {
+    'recipes': fields.List(fields.Nested(recipe_quantity_model), required=True)
+})
+
+
+def add_recipes_to_cart(quantities):
+    # Add the ingredients of the recipes (recipe id: quantity) to the current
+    # user's cart in one statement and commit
+    user = User.query.filter_by(username=get_jwt_identity()).first()
+    if not user:
+        return {'message': 'User not found'}, 404
+
+    catalog = recipe_catalog.snapshot()
+    missing = [recipe_id for recipe_id in quantities if catalog.get(recipe_id) is None]
+    if missing:
+        return {'message': f'Recipe {missing[0]} not found'}, 404
+
+    try:
+        lines = add_recipe_ingredients(user.id, quantities).rowcount
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return {'message': 'Failed to add the recipe ingredients to the cart', 'error': str(e)}, 500
+    return {'message': 'Recipe ingredients added to cart', 'lines': lines}, 201
+
+
+def valid_quantity(quantity):
+    return is_integer(quantity) and quantity > 0
+
+
+# class to add the ingredients of a recipe to the cart
+@recipes_ns.route('/<int:id>/add-to-cart')
+class RecipeToCart(Resource):
+    @jwt_required()
+    @idempotent('recipe_to_cart')
+    @recipes_ns.expect(recipe_to_cart_model)
+    def post(self, id):
+        """Add the ingredients of a recipe to the cart"""
+        quantity = (request.get_json(silent=True) or {}).get('quantity', 1)
+        if not valid_quantity(quantity):
+            recipes_ns.abort(400, 'quantity must be a positive integer')
+        return add_recipes_to_cart({id: quantity})
+
+
+# class to add the ingredients of several recipes to the cart, shared
+# ingredients are merged into one cart line
+@recipes_ns.route('/add-to-cart')
+class RecipesToCart(Resource):
+    @jwt_required()
+    @idempotent('recipes_to_cart')
+    @recipes_ns.expect(recipes_to_cart_model)
+    def post(self):
+        """Add the ingredients of several recipes to the cart"""
+        recipes = (request.get_json(silent=True) or {}).get('recipes')
+        if not isinstance(recipes, list) or not recipes:
+            recipes_ns.abort(400, 'recipes is required')
+        if len(recipes) > MAX_CART_RECIPES:
+            recipes_ns.abort(400, f'At most {MAX_CART_RECIPES} recipes can be added at once')
+
+        quantities = {}
+        for recipe in recipes:
+            recipe_id = recipe.get('recipe_id') if isinstance(recipe, dict) else None
+            quantity = recipe.get('quantity', 1) if isinstance(recipe, dict) else None
+            if not is_integer(recipe_id) or not valid_quantity(quantity):
+                recipes_ns.abort(400, 'Each recipe needs a recipe_id and a positive integer quantity')
+            quantities[recipe_id] = quantities.get(recipe_id, 0) + quantity
+        return add_recipes_to_cart(quantities)
 
 
 # class for retrieving details of a specific recipe by ID
 @recipes_ns.route('/<int:id>')
 class RecipeResource(Resource):
-    @recipes_ns.marshal_with(recipe_model)
+    @recipes_ns.response(200, 'Success', recipe_model)
     def get(self, id):
         """Get a specific recipe by ID"""
 
-        # Get a specific recipe by its ID, 404 if not found
-        recipe = Recipe.query.get_or_404(id)
-        return recipe.serialize()
+        # Get a specific recipe by its ID from the catalog, 404 if not found
+        recipe = recipe_catalog.snapshot().get(id)
+        if recipe is None:
+            recipes_ns.abort(404, 'Recipe not found')
+        return recipe
 
 
 # Class to specifically search for recipes
 @recipes_ns.route('/search')
 class RecipeSearch(Resource):
-    @recipes_ns.marshal_list_with(recipe_model)
-    @recipes_ns.doc(params={'q': 'Search term', 'vegan': 'Filter for vegan recipes', 'gluten_free': 'Filter for gluten-free recipes', 'page': 'Page number', 'per_page': 'Recipes per page'})
+    @recipes_ns.response(200, 'Success', [recipe_model])
+    @recipes_ns.doc(params={'q': 'Search term, matched against names, descriptions and ingredients', 'vegan': 'Filter for vegan recipes', 'gluten_free': 'Filter for gluten-free recipes', 'page': 'Page number', 'per_page': 'Recipes per page', 'count': 'true to return the number of matches in X-Total-Count'})
     def get(self):
         """Search for recipes"""
         search_term = request.args.get('q', '')
         is_vegan = request.args.get('vegan', '').lower() == 'true'
         is_gluten_free = request.args.get('gluten_free', '').lower() == 'true'
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
+        count = request.args.get('count', '').lower() == 'true'
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', DEFAULT_PER_PAGE, type=int), 1), MAX_PER_PAGE)
+
+        catalog = recipe_catalog.snapshot()
+        match = match_expression(search_term)
 
+        if match:
+            # Ranked matches from the search index, the payloads from the catalog
+            recipe_ids, has_more, total = search_recipes(match, is_vegan, is_gluten_free, page, per_page, count)
+            recipes = [recipe for recipe in map(catalog.get, recipe_ids) if recipe is not None]
+        else:
+            # No search term, filter the catalog
+            matches = [recipe for recipe in catalog.recipes
+                       if (not is_vegan or recipe['is_vegan']) and (not is_gluten_free or recipe['is_gluten_free'])]
+            start = (page - 1) * per_page
+            recipes = matches[start:start + per_page]
+            has_more = start + per_page < len(matches)
+            total = len(matches)
 
-        # Start building the query
-        query = Recipe.query
+        headers = {}
+        if has_more:
+            headers['X-Next-Page'] = str(page + 1)
+        if count:
+            headers['X-Total-Count'] = str(total)
+        return recipes, 200, headers
 
 
-        # Apply filters based on search parameters
-        if search_term:
-            query = query.filter(Recipe.name.ilike(f'%{search_term}%'))
-        if is_vegan:
-            query = query.filter_by(is_vegan=True)
-        if is_gluten_free:
-            query = query.filter_by(is_gluten_free=True)
+# recipe with its ingredient similarity to another recipe
+similar_recipe_model = recipes_ns.inherit('SimilarRecipe', recipe_model, {
+    'similarity': fields.Float()
+})
+
+
+# class to find recipes with ingredients similar to a recipe
+@recipes_ns.route('/<int:id>/similar')
+class SimilarRecipes(Resource):
+    @recipes_ns.response(200, 'Success', [similar_recipe_model])
+    @recipes_ns.doc(params={
+        'limit': 'Number of recipes, 10 by default',
+        'min_similarity': 'Smallest Jaccard similarity of the ingredients, from 0 to 1'
+    })
+    def get(self, id):
+        """Get recipes with ingredients similar to a recipe"""
+        catalog = recipe_catalog.snapshot()
+        if catalog.get(id) is None:
+            recipes_ns.abort(404, 'Recipe not found')
+        limit = min(max(request.args.get('limit', 10, type=int), 1), MAX_PER_PAGE)
+        min_similarity = request.args.get('min_similarity', 0.0, type=float)
 
-        # Paginate the query results
-        paginated_recipes = query.paginate(page=page, per_page=per_page)
-        return [recipe.serialize() for recipe in paginated_recipes.items]
+        similar = catalog.similarity.similar(id, limit, min_similarity)
+        return [dict(catalog.get(recipe_id), similarity=similarity) for recipe_id, similarity in similar], 200
 
 
 #class to get the recipe by ingredient ID
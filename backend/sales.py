@@ -0,0 +1,166 @@
+import threading
+from collections import Counter
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import event, update, case, func, delete
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from exts import db
+from models import Item, Order, OrderItem, ArchivedOrder, ArchivedOrderItem, previous_purchases
+from order_states import PAYMENT_FAILED
+
+# Sales counters and purchase history maintained at checkout.
+# Both are written with set-based statements: one UPDATE ... CASE for all the
+# items of a checkout and one INSERT OR IGNORE for the purchase history.
+# When the payment of an order fails both are taken back, see payments.
+
+
+def increment_sales(counts):
+    # Add the quantities in counts ({item_id: quantity}) to Item.sales with a single UPDATE
+    if not counts:
+        return
+    db.session.execute(
+        update(Item)
+        .where(Item.id.in_(list(counts)))
+        .values(sales=Item.sales + case(counts, value=Item.id, else_=0))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def record_purchases(user_id, item_ids):
+    # Add the items to the user's previous purchases, ignoring ones already there
+    rows = [{'user_id': user_id, 'item_id': item_id} for item_id in set(item_ids)]
+    if rows:
+        db.session.execute(sqlite_insert(previous_purchases).on_conflict_do_nothing(), rows)
+
+
+def forget_purchases(order):
+    # Remove the order's items from the user's previous purchases, except the
+    # ones in another of the user's orders (hot or archived) that didn't fail
+    item_ids = {item_id for (item_id,) in db.session.query(OrderItem.item_id).filter(OrderItem.order_id == order.id)}
+    if not item_ids:
+        return
+    for order_model, line_model in ((Order, OrderItem), (ArchivedOrder, ArchivedOrderItem)):
+        item_ids -= {item_id for (item_id,) in db.session.query(line_model.item_id)
+                     .join(order_model, order_model.id == line_model.order_id)
+                     .filter(order_model.user_id == order.user_id, order_model.id != order.id,
+                             order_model.status != PAYMENT_FAILED, line_model.item_id.in_(item_ids))}
+    if item_ids:
+        db.session.execute(delete(previous_purchases).where(
+            previous_purchases.c.user_id == order.user_id, previous_purchases.c.item_id.in_(item_ids)))
+
+
+# Write-behind aggregator: checkouts add their counts in memory and a background
+# thread applies the coalesced increments periodically, so checkouts of hot
+# items don't queue up on the same rows. Counts not yet flushed are lost if
+# the process dies, run the backfill command to rebuild them.
+class SalesAggregator:
+    def __init__(self, interval=5.0):
+        self.interval = interval
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, counts):
+        with self._lock:
+            self._pending.update(counts)
+
+    def flush(self):
+        # Apply every pending increment with one UPDATE, must run in an app context
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+        if not pending:
+            return
+        try:
+            increment_sales(dict(pending))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Failed to flush sales counters: {str(e)}")
+            # Put the counts back so the next flush retries them
+            self.add(pending)
+
+    def start(self, app):
+        def run():
+            while not self._stop.wait(self.interval):
+                with app.app_context():
+                    self.flush()
+
+        self._thread = threading.Thread(target=run, name='sales-write-behind', daemon=True)
+        self._thread.start()
+
+    def stop(self, app):
+        self._stop.set()
+        with app.app_context():
+            self.flush()
+
+
+sales_aggregator = SalesAggregator()
+
+
+def record_checkout_sales(counts):
+    # Route sales increments through the aggregator when write-behind is enabled,
+    # otherwise apply them in the caller's transaction. The aggregator only
+    # gets them once that transaction commits, a rollback drops them.
+    if current_app.config.get('SALES_WRITE_BEHIND', False):
+        db.session.info.setdefault('pending_sales', Counter()).update(counts)
+    else:
+        increment_sales(counts)
+
+
+@event.listens_for(Session, 'after_commit')
+def hand_over_sales(session):
+    counts = session.info.pop('pending_sales', None)
+    if counts:
+        sales_aggregator.add(counts)
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_sales(session):
+    session.info.pop('pending_sales', None)
+
+
+def backfill_sales():
+    # Rebuild Item.sales and previous_purchases from the order lines, hot and
+    # archived, leaving out the orders whose payment failed. The archive is a
+    # separate database, so both are aggregated here and written with one
+    # UPDATE ... CASE and one INSERT OR IGNORE.
+    sold = Counter()
+    purchases = set()
+    for order_model, line_model in ((Order, OrderItem), (ArchivedOrder, ArchivedOrderItem)):
+        placed = order_model.status != PAYMENT_FAILED
+        sold.update(dict(
+            db.session.query(line_model.item_id, func.sum(line_model.quantity))
+            .join(order_model, order_model.id == line_model.order_id)
+            .filter(placed)
+            .group_by(line_model.item_id)
+            .all()
+        ))
+        purchases.update(
+            db.session.query(order_model.user_id, line_model.item_id)
+            .join(order_model, order_model.id == line_model.order_id)
+            .filter(placed)
+            .distinct()
+            .all()
+        )
+
+    # Items sold by no order are reset to 0
+    sales = case(dict(sold), value=Item.id, else_=0) if sold else 0
+    db.session.execute(update(Item).values(sales=sales).execution_options(synchronize_session=False))
+
+    # archived lines can refer to items removed since
+    items = {item_id for (item_id,) in db.session.query(Item.id)}
+    rows = [{'user_id': user_id, 'item_id': item_id} for user_id, item_id in purchases if item_id in items]
+    if rows:
+        db.session.execute(sqlite_insert(previous_purchases).on_conflict_do_nothing(), rows)
+    db.session.commit()
+
+
+@click.command('backfill-sales')
+@with_appcontext
+def backfill_sales_command():
+    """Rebuild item sales counters and purchase history from order items."""
+    backfill_sales()
+    click.echo('Sales counters and purchase history rebuilt.')
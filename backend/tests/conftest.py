@@ -0,0 +1,48 @@
+import os
+import sys
+from contextlib import contextmanager
+import pytest
+from sqlalchemy import event
+
+# The backend modules import each other by their top level names
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from exts import db
+from main import create_app
+
+
+@pytest.fixture
+def app(tmp_path):
+    # App on empty databases in tmp_path, used inside its app context
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'test.db'}",
+        'SQLALCHEMY_BINDS': {'archive': f"sqlite:///{tmp_path / 'archive.db'}"},
+    })
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def count_statements(app):
+    # Context manager collecting the statements sent to every database, the
+    # archive included
+    @contextmanager
+    def count():
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        engines = list(db.engines.values())
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', record)
+        try:
+            yield statements
+        finally:
+            for engine in engines:
+                event.remove(engine, 'before_cursor_execute', record)
+
+    return count
@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+from exts import db
+from archive import archive_orders
+from sales import backfill_sales
+from models import (User, Item, Order, OrderItem, CheckoutItem, PaymentJob, ArchivedOrder, ArchivedOrderItem,
+                    previous_purchases)
+
+# Archiving moves old finished orders to the archive database, see archive
+
+
+def place_order(user, items, status='Processed', days_ago=200):
+    # An order of one of each item paid with its own card, as checkout stores it
+    created_at = datetime.utcnow() - timedelta(days=days_ago)
+    order = Order(user_id=user.id, total_price=sum(item.price for item in items), status=status,
+                  created_at=created_at, updated_at=created_at)
+    db.session.add(order)
+    db.session.flush()
+    db.session.add_all([
+        OrderItem(order_id=order.id, item_id=item.id, quantity=1, total_price=item.price,
+                  item_name=item.name, unit_price=item.price, discount=0.0, picture=item.picture)
+        for item in items
+    ])
+    checkout_item = CheckoutItem(ccNumber='4111111111111111', expiry='12/30', ccv='123')
+    db.session.add_all([checkout_item, PaymentJob(order=order, checkout_item=checkout_item, status='Succeeded')])
+    db.session.commit()
+    return order
+
+
+def seed_items(count):
+    user = User(username='customer', email='customer@example.com', password='x')
+    items = [Item(name=f'item {index}', price=1.0 + index, calorie=100, vegan=True, glutenFree=True,
+                  discount=0.0, picture='item.jpg') for index in range(count)]
+    db.session.add(user)
+    db.session.add_all(items)
+    db.session.commit()
+    return user, items
+
+
+def test_archive_moves_orders_and_drops_their_card_details(app):
+    user, items = seed_items(3)
+    old = place_order(user, items[:2]).id
+    recent = place_order(user, items[2:], days_ago=1)
+    recent_card = recent.payment_jobs[0].checkout_item_id
+
+    assert archive_orders() == 1
+
+    assert db.session.get(ArchivedOrder, old) is not None
+    assert ArchivedOrderItem.query.filter_by(order_id=old).count() == 2
+    assert Order.query.count() == 1 and OrderItem.query.count() == 1
+    # only the card of the recent order is left
+    assert PaymentJob.query.count() == 1
+    assert [checkout_item.id for checkout_item in CheckoutItem.query] == [recent_card]
+
+
+def test_backfill_sales_counts_archived_orders(app):
+    user, items = seed_items(3)
+    place_order(user, items[:2])
+    place_order(user, items[1:], days_ago=1)
+    place_order(user, items, status='Payment Failed')
+    assert archive_orders() == 2
+
+    Item.query.update({'sales': 99})
+    db.session.execute(previous_purchases.delete())
+    db.session.commit()
+    backfill_sales()
+
+    assert [item.sales for item in Item.query.order_by(Item.id)] == [1, 2, 1]
+    assert sorted(item.id for item in db.session.get(User, user.id).items) == [item.id for item in items]
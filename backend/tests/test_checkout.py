@@ -0,0 +1,68 @@
+import time
+import pytest
+from sqlalchemy import event
+from flask_jwt_extended import create_access_token
+from exts import db
+from models import User, Item, CartItem, Order, OrderItem
+from payments import payment_queue
+
+# Checkout writes the whole cart with set-based statements (one bulk insert
+# of the order lines, one UPDATE ... CASE of the sales counters, ...) in a
+# single transaction, so its cost doesn't grow with the number of cart lines.
+
+# user, purchases, cart lines with their items, order, order lines, sales
+# counters, purchase history, daily rollup, item rollups, cart, card,
+# payment job, then the order and payment job reloaded after the commit
+EXPECTED_STATEMENTS = 14
+
+CARD = {'ccNumber': '4111111111111111', 'expiry': '12/30', 'ccv': '123'}
+
+
+@pytest.fixture
+def queued(monkeypatch):
+    # Keep the payments from running in the background workers while counting
+    job_ids = []
+    monkeypatch.setattr(payment_queue, 'enqueue', lambda job_id, delay=0: job_ids.append(job_id))
+    return job_ids
+
+
+def seed_cart(lines):
+    user = User(username='customer', email='customer@example.com', password='x')
+    items = [Item(name=f'item {index}', price=1.0 + index, calorie=100, vegan=True, glutenFree=True,
+                  discount=0.0, picture='item.jpg') for index in range(lines)]
+    db.session.add(user)
+    db.session.add_all(items)
+    db.session.flush()
+    db.session.add_all([CartItem(user_id=user.id, item_id=item.id, quantity=2) for item in items])
+    db.session.commit()
+    return user
+
+
+@pytest.mark.parametrize('lines', [1, 10, 50, 200])
+def test_checkout_statements_and_commits_are_flat(app, count_statements, queued, lines):
+    user = seed_cart(lines)
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {create_access_token(identity=user.username)}'}
+    db.session.expire_all()
+
+    commits = []
+    engine = db.engines[None]
+
+    def record_commit(conn):
+        commits.append(conn)
+
+    event.listen(engine, 'commit', record_commit)
+    try:
+        with count_statements() as statements:
+            started = time.perf_counter()
+            response = client.post('/checkout/payment', json=CARD, headers=headers)
+            elapsed = time.perf_counter() - started
+    finally:
+        event.remove(engine, 'commit', record_commit)
+
+    assert response.status_code == 202, response.get_json()
+    assert len(statements) == EXPECTED_STATEMENTS, [statement[:60] for statement in statements]
+    assert len(commits) == 1
+    assert len(queued) == 1
+    assert Order.query.count() == 1 and OrderItem.query.count() == lines
+    print(f'checkout of {lines} cart lines: {elapsed * 1000:.1f} ms')
@@ -0,0 +1,60 @@
+import random
+import time
+from meal_plans import plan_meals, CALORIE_TOLERANCE
+from recipe_catalog import CatalogSnapshot
+
+# The meal plan solver on a synthetic catalog, no database needed: plans are
+# computed from the catalog snapshot the endpoint serves.
+
+CATALOG_SIZE = 5000
+ITEMS = 2000
+
+
+def synthetic_catalog(size, seed=3):
+    # Half the recipes are light dishes, half full meals
+    rng = random.Random(seed)
+    prices = {item_id: round(rng.uniform(0.5, 8.0), 2) for item_id in range(1, ITEMS + 1)}
+    recipes = []
+    for recipe_id in range(1, size + 1):
+        item_ids = rng.sample(sorted(prices), rng.randint(2, 9))
+        recipes.append({
+            'id': recipe_id,
+            'name': f'recipe {recipe_id}',
+            'is_vegan': rng.random() < 0.3,
+            'is_gluten_free': rng.random() < 0.5,
+            'total_calories': rng.randint(100, 400) if recipe_id % 2 else rng.randint(1400, 2600),
+            'total_cost': round(sum(prices[item_id] for item_id in item_ids), 2),
+            'ingredients': [{'id': item_id, 'name': f'item {item_id}', 'price': prices[item_id]}
+                            for item_id in item_ids]
+        })
+    return CatalogSnapshot(1, recipes)
+
+
+def test_daily_calories_is_a_target():
+    catalog = synthetic_catalog(1000)
+    planned, _ = plan_meals(catalog, days=7, daily_calories=2000)
+
+    assert len(planned) == 7
+    for recipe in planned:
+        assert abs(recipe['total_calories'] - 2000) <= 2000 * CALORIE_TOLERANCE
+
+
+def test_plan_reuses_ingredients_within_the_budget():
+    catalog = synthetic_catalog(1000)
+    planned, shopping = plan_meals(catalog, days=7, budget=60)
+
+    assert len(planned) == 7
+    assert len({recipe['id'] for recipe in planned}) == 7
+    assert sum(line['unit_price'] for line in shopping) <= 60 + 0.005
+    assert sum(line['recipes'] for line in shopping) == sum(len(recipe['ingredients']) for recipe in planned)
+
+
+def test_plan_of_a_large_catalog_is_fast():
+    catalog = synthetic_catalog(CATALOG_SIZE)
+    for constraints in ({}, {'budget': 80, 'daily_calories': 2000}, {'vegan': True, 'budget': 60}):
+        started = time.perf_counter()
+        planned, _ = plan_meals(catalog, days=28, **constraints)
+        elapsed = time.perf_counter() - started
+        print(f'{constraints}: {len(planned)} recipes in {elapsed * 1000:.1f} ms')
+        assert planned
+        assert elapsed < 0.2
@@ -0,0 +1,73 @@
+import pytest
+from flask_jwt_extended import create_access_token
+from exts import db
+from models import User, Item, Order, OrderItem, ArchivedOrder, ArchivedOrderItem
+
+# The order listings are assembled with batched queries (see order_assembly),
+# so each endpoint runs the same number of statements however many orders
+# and lines it returns.
+
+LINES_PER_ORDER = 4
+
+# endpoint: statements per request. Loading a user also loads their
+# previous purchases (User.items is a subquery eager load).
+EXPECTED_STATEMENTS = {
+    # user, purchases, pending orders, their lines
+    '/orders/': 4,
+    # user, purchases, orders, archived orders, lines of both
+    '/orders/history': 6,
+    # orders, lines
+    '/orders/employee/orders': 2,
+    # orders, their users, purchases, lines
+    '/orders/employee/orders/history': 4,
+    # user, purchases, orders, archived orders, lines of both
+    '/checkout/items': 6,
+}
+
+
+def seed(orders):
+    # orders pending, processed and archived orders of one user, with
+    # LINES_PER_ORDER lines each
+    user = User(username='customer', email='customer@example.com', password='x')
+    items = [Item(name=f'item {index}', price=1.0 + index, calorie=100, vegan=True, glutenFree=True,
+                  discount=0.0, picture='item.jpg') for index in range(LINES_PER_ORDER)]
+    db.session.add(user)
+    db.session.add_all(items)
+    db.session.flush()
+
+    for index in range(orders):
+        order = Order(user_id=user.id, total_price=10.0, status='Pending' if index % 2 else 'Processed')
+        db.session.add(order)
+        db.session.flush()
+        db.session.add_all([
+            OrderItem(order_id=order.id, item_id=item.id, quantity=1, total_price=item.price,
+                      item_name=item.name, unit_price=item.price, discount=0.0, picture=item.picture)
+            for item in items
+        ])
+
+        archived = ArchivedOrder(id=100000 + index, user_id=user.id, status='Processed', total_price=10.0,
+                                 version=1, created_at=order.created_at, updated_at=order.created_at)
+        db.session.add(archived)
+        db.session.add_all([
+            ArchivedOrderItem(order_id=archived.id, item_id=item.id, quantity=1, total_price=item.price,
+                              item_name=item.name, unit_price=item.price, discount=0.0, picture=item.picture)
+            for item in items
+        ])
+    db.session.commit()
+    return user
+
+
+@pytest.mark.parametrize('orders', [2, 40])
+@pytest.mark.parametrize('path', list(EXPECTED_STATEMENTS))
+def test_order_listing_statement_count(app, count_statements, orders, path):
+    user = seed(orders)
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {create_access_token(identity=user.username)}'}
+    db.session.expire_all()
+
+    with count_statements() as statements:
+        response = client.get(path, query_string={'limit': 200}, headers=headers)
+
+    assert response.status_code == 200
+    assert response.get_json()
+    assert len(statements) == EXPECTED_STATEMENTS[path], statements
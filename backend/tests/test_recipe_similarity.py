@@ -0,0 +1,87 @@
+import random
+import time
+import pytest
+from recipe_similarity import SimilarityIndex, EXACT_SCAN_LIMIT, jaccard
+
+# The MinHash/LSH lookup against a brute-force scan of the whole catalog, on
+# a synthetic catalog of recipe families: variants of a base recipe with a
+# few ingredients swapped, so there are pairs at every similarity.
+
+CATALOG_SIZE = 5000
+ITEMS = 2000
+RECIPE_SIZE = 8
+QUERIES = 200
+
+# lowest recall allowed at each min_similarity, below what 16 bands of 4
+# rows give a single pair (see recipe_similarity)
+MIN_RECALL = {0.5: 0.6, 0.7: 0.95}
+
+
+def synthetic_catalog(size, seed=7):
+    rng = random.Random(seed)
+    catalog = {}
+    while len(catalog) < size:
+        base = set(rng.sample(range(ITEMS), RECIPE_SIZE))
+        for _ in range(rng.randint(1, 10)):
+            variant = set(base)
+            for item in rng.sample(sorted(base), rng.randint(0, 3)):
+                variant.discard(item)
+                variant.add(rng.randrange(ITEMS))
+            catalog[len(catalog) + 1] = variant
+    return dict(list(catalog.items())[:size])
+
+
+def brute_force(catalog, recipe_id, min_similarity):
+    items = catalog[recipe_id]
+    return {
+        other for other, other_items in catalog.items()
+        if other != recipe_id and jaccard(items, other_items) >= min_similarity and items & other_items
+    }
+
+
+@pytest.fixture(scope='module')
+def catalog():
+    return synthetic_catalog(CATALOG_SIZE)
+
+
+@pytest.fixture(scope='module')
+def index(catalog):
+    return SimilarityIndex(catalog)
+
+
+@pytest.mark.parametrize('min_similarity', sorted(MIN_RECALL))
+def test_lsh_recall_and_speed_against_brute_force(catalog, index, min_similarity):
+    assert len(catalog) > EXACT_SCAN_LIMIT
+    queries = random.Random(1).sample(sorted(catalog), QUERIES)
+
+    started = time.perf_counter()
+    found = {recipe_id: index.similar(recipe_id, limit=len(catalog), min_similarity=min_similarity)
+             for recipe_id in queries}
+    lsh_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    expected = {recipe_id: brute_force(catalog, recipe_id, min_similarity) for recipe_id in queries}
+    brute_time = time.perf_counter() - started
+
+    relevant = sum(len(matches) for matches in expected.values())
+    retrieved = 0
+    for recipe_id, matches in found.items():
+        # candidates are verified with the exact similarity, so every match is right
+        assert all(jaccard(catalog[recipe_id], catalog[match]) == similarity for match, similarity in matches)
+        assert {match for match, _ in matches} <= expected[recipe_id]
+        retrieved += len(matches)
+
+    recall = retrieved / relevant
+    print(f'min_similarity {min_similarity}: recall {recall:.3f} over {relevant} pairs, '
+          f'LSH {lsh_time * 1000:.0f} ms, brute force {brute_time * 1000:.0f} ms for {QUERIES} lookups')
+    assert relevant > 0
+    assert recall >= MIN_RECALL[min_similarity]
+    assert lsh_time < brute_time
+
+
+def test_small_catalogs_are_compared_exactly():
+    catalog = synthetic_catalog(500)
+    index = SimilarityIndex(catalog)
+    for recipe_id in list(catalog)[:50]:
+        found = {match for match, _ in index.similar(recipe_id, limit=len(catalog), min_similarity=0.1)}
+        assert found == brute_force(catalog, recipe_id, 0.1)
@@ -0,0 +1,25 @@
+from exts import db
+from models import Item
+from sales import record_checkout_sales, sales_aggregator
+
+# With SALES_WRITE_BEHIND the counts of a checkout only reach the in-memory
+# aggregator once its transaction commits, see sales
+
+
+def test_write_behind_counts_wait_for_the_commit(app):
+    app.config['SALES_WRITE_BEHIND'] = True
+    item = Item(name='item', price=1.0, calorie=100, vegan=True, glutenFree=True, discount=0.0, picture='item.jpg')
+    db.session.add(item)
+    db.session.commit()
+
+    record_checkout_sales({item.id: 2})
+    db.session.rollback()
+    sales_aggregator.flush()
+    assert db.session.get(Item, item.id).sales == 0
+
+    record_checkout_sales({item.id: 3})
+    assert db.session.get(Item, item.id).sales == 0
+    db.session.commit()
+    sales_aggregator.flush()
+    db.session.expire_all()
+    assert db.session.get(Item, item.id).sales == 3
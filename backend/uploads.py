@@ -0,0 +1,92 @@
+import hashlib
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.utils import secure_filename
+
+# Profile picture upload pipeline.
+# Uploads are streamed to a temp file while being hashed, stored under their
+# content hash (so identical uploads share one file) and resized into avatar
+# sizes by a background worker.
+
+ALLOWED_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.webp'}
+AVATAR_SIZES = (64, 128, 256)
+CHUNK_SIZE = 64 * 1024
+
+# background pool that generates the avatar sizes
+resize_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='avatar-resize')
+
+
+def picture_extension(filename):
+    # Return the lower-cased extension of an uploaded file, None if not allowed
+    ext = os.path.splitext(secure_filename(filename or ''))[1].lower()
+    return ext if ext in ALLOWED_EXTENSIONS else None
+
+
+def avatar_filename(filename, size):
+    # Name of the resized copy of a stored picture, e.g. <hash>_128.png
+    name, ext = os.path.splitext(filename)
+    return f"{name}_{size}{ext}"
+
+
+def store_profile_picture(file_storage, upload_dir):
+    # Stream the upload to a temp file in upload_dir while hashing it, then
+    # move it to <sha256><ext>. Returns the stored filename, or None if the
+    # file type is not allowed.
+    ext = picture_extension(file_storage.filename)
+    if ext is None:
+        return None
+
+    os.makedirs(upload_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    fd, temp_path = tempfile.mkstemp(dir=upload_dir, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            while True:
+                chunk = file_storage.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                temp_file.write(chunk)
+
+        filename = digest.hexdigest() + ext
+        final_path = os.path.join(upload_dir, filename)
+        if os.path.exists(final_path):
+            # Same content was uploaded before, keep the existing copy
+            os.remove(temp_path)
+            return filename
+
+        os.replace(temp_path, final_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    resize_executor.submit(make_avatars, final_path)
+    return filename
+
+
+def make_avatars(path, sizes=AVATAR_SIZES):
+    # Write square thumbnails of the picture next to it, cropped around the
+    # centre, skipping sizes that already exist. Runs on the background
+    # resize pool.
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        logging.warning("Pillow is not installed, skipping avatar resizing")
+        return
+
+    directory, filename = os.path.split(path)
+    try:
+        with Image.open(path) as image:
+            for size in sizes:
+                target = os.path.join(directory, avatar_filename(filename, size))
+                if os.path.exists(target):
+                    continue
+                thumbnail = ImageOps.fit(image, (size, size))
+                if target.endswith(('.jpg', '.jpeg')) and thumbnail.mode != 'RGB':
+                    thumbnail = thumbnail.convert('RGB')
+                thumbnail.save(target)
+    except Exception as e:
+        logging.error(f"Failed to resize profile picture {filename}: {str(e)}")